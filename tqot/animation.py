@@ -1,26 +1,33 @@
-import pygame.time
+from tqot.clock import *
 
 
 class Animation:
     """
     Class that defines simple looped frame-by-frame animations
-    on art-assets and plays them when prompted to.
+    on art-assets and plays them when prompted to. Frames are
+    resolved to the surfaces when they are added and the sprite
+    is only touched when the displayed frame changes, so playing
+    an animation costs a single clock read and a comparison.
     """
 
-    def __init__(self, sprite):
+    def __init__(self, sprite, clock=None):
         """
         Create a new animation.
         :param sprite: Asset sprite that will play the animation.
+        :param clock: Clock that drives the animation (wall-clock time by default).
         :return: An empty animation instance.
         """
-        # Store the associated sprite
+        # Store the associated sprite and clock
         self.sprite = sprite
+        self.clock = clock if clock is not None else WallClock()
         # Initialise the animation as empty by default
         self.frames = []
         # Current frame index
         self.current = 0
-        # Ticks when the frame got shown
-        self.duration = 0
+        # Ticks when the frame got shown (None if not playing)
+        self.duration = None
+        # Frame index that the sprite displays (None if not known)
+        self.displayed = None
 
     def add_frame(self, state, duration):
         """
@@ -28,14 +35,14 @@ class Animation:
         :param state: State the the art asset should be in.
         :param duration: Duration of the frame in milliseconds.
         """
-        self.frames.append((state, duration))
+        self.frames.append((state, self.sprite.get_frame(state), duration))
 
     def is_playing(self):
         """
         Identify whether the animation is currently playing.
         :return: True if animation is active, false otherwise.
         """
-        return self.duration != 0
+        return self.duration is not None
 
     def play(self):
         """
@@ -43,21 +50,20 @@ class Animation:
         measuring all the timings, changing states and looping. Similar
         to update() method of a sprite.
         """
+        # Identify the current time once
+        now = self.clock.get_ticks()
         # Just started playing the animation
-        if self.duration == 0:
-            self.duration = pygame.time.get_ticks()
+        if self.duration is None:
+            self.duration = now
 
-        # Retrieve the current frame information
-        (state, duration) = self.frames[self.current]
-        self.sprite.set_state(state)
-        # Check whether the state needs changing
-        elapsed = pygame.time.get_ticks() - self.duration
-        if elapsed > duration:
-            self.current += 1
-            self.duration = pygame.time.get_ticks()
-        # Check whether the loop is needed
-        if self.current == len(self.frames):
-            self.current = 0
+        # Display the current frame unless it already is
+        current = self.current
+        if current != self.displayed:
+            self.invalidate()
+        # Move on to the next frame (looping if needed) once the current one has been shown long enough
+        if now - self.duration > self.frames[current][2]:
+            self.current = current + 1 if current + 1 < len(self.frames) else 0
+            self.duration = now
 
     def invalidate(self):
         """
@@ -65,8 +71,9 @@ class Animation:
         Internal routine necessary to be carried out after the
         animation flow was manually altered.
         """
-        (state, duration) = self.frames[self.current]
-        self.sprite.set_state(state)
+        (state, image, duration) = self.frames[self.current]
+        self.sprite.set_frame(state, image)
+        self.displayed = self.current
 
     def stop(self):
         """
@@ -77,5 +84,7 @@ class Animation:
             return
         # Reset the animation state
         self.current = 0
-        self.duration = 0
-        self.invalidate()
\ No newline at end of file
+        self.duration = None
+        self.invalidate()
+        # Other animations may take over the sprite once stopped
+        self.displayed = None
@@ -0,0 +1,440 @@
+import collections
+import concurrent.futures
+import json
+import os
+import pygame
+import pygame.image
+import struct
+import time
+
+
+class AssetCache:
+    """
+    Class that defines a process-wide cache for the converted
+    art assets. Surfaces are keyed by asset name and state and
+    shared between all the sprites, therefore they should be
+    treated as immutable. All the art assets can be preloaded
+    up front, decoding the image files on a thread pool. The
+    least recently used surfaces are evicted once the byte budget
+    is exceeded. In headless mode the surfaces are not converted
+    for the display and, optionally, not even decoded: blank
+    surfaces of the right size are used.
+    """
+    # Default budget for the cached surfaces (in bytes)
+    BUDGET = 32 * 1024 * 1024
+
+    def __init__(self, budget=BUDGET):
+        """
+        Create a new asset cache.
+        :param budget: Maximum total size of the cached surfaces in bytes.
+        :return: An empty asset cache.
+        """
+        self.budget = budget
+        # Whether the surfaces are converted for the display
+        self.convert_surfaces = True
+        # Whether the image files are decoded
+        self.decode = True
+        # Texture atlas that the frames are taken from (if any)
+        self.atlas = None
+        # Cached surfaces in the order of their use
+        self.surfaces = collections.OrderedDict()
+        # Total size of the cached surfaces and the atlas pages
+        self.size = 0
+        # Cache statistics
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(name, state=None):
+        """
+        Identify the art asset following the Name-State scheme.
+        :param name: Asset name.
+        :param state: Asset state (if any).
+        :return: Key as a string.
+        """
+        if state is None:
+            return name
+        return name + "-" + state
+
+    @staticmethod
+    def get_asset(name, state=None):
+        """
+        Identify the relative path to the art asset.
+        :param name: Asset name.
+        :param state: Asset state (if any).
+        :return: Path as a string.
+        """
+        return "../assets/" + AssetCache.get_key(name, state) + ".png"
+
+    @staticmethod
+    def discover(directory="../assets/"):
+        """
+        Discover all the art assets the sprites can reference.
+        :param directory: Directory with the art assets.
+        :return: Sorted list of the asset keys.
+        """
+        return sorted(x[:-4] for x in os.listdir(directory) if x.endswith(".png"))
+
+    @staticmethod
+    def decode_files(paths, workers=None, progress=None):
+        """
+        Decode the image files on a thread pool (decoding releases the GIL).
+        :param paths: Paths to the images.
+        :param workers: Number of the worker threads (chosen by the pool by default).
+        :param progress: Callable invoked with the number of decoded and total images.
+        :return: List of the decoded surfaces in the order of the paths.
+        """
+        surfaces = [None] * len(paths)
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = dict((executor.submit(pygame.image.load, x), i) for (i, x) in enumerate(paths))
+            for (done, future) in enumerate(concurrent.futures.as_completed(futures)):
+                surfaces[futures[future]] = future.result()
+                if progress is not None:
+                    progress(done + 1, len(paths))
+        return surfaces
+
+    def configure(self, convert=True, decode=True):
+        """
+        Configure how the art assets are loaded. The cache is cleared
+        if the configuration changes.
+        :param convert: Whether the surfaces are converted for the display.
+        :param decode: Whether the image files are decoded.
+        """
+        if (convert, decode) != (self.convert_surfaces, self.decode):
+            self.clear()
+        self.convert_surfaces = convert
+        self.decode = decode
+
+    def convert(self, surface, alpha=True):
+        """
+        Convert the surface for the display unless running headless.
+        :param surface: Surface to be converted.
+        :param alpha: Whether the per-pixel alpha should be preserved.
+        :return: Converted surface.
+        """
+        if not self.convert_surfaces:
+            return surface
+        return surface.convert_alpha() if alpha else surface.convert()
+
+    @staticmethod
+    def read_size(path):
+        """
+        Read the dimensions of the image from the PNG header.
+        :param path: Path to the image.
+        :return: Tuple of width and height.
+        """
+        with open(path, "rb") as file:
+            header = file.read(24)
+        if header[:8] != b"\x89PNG\r\n\x1a\n" or header[12:16] != b"IHDR":
+            raise ValueError("Not a PNG image: " + path)
+        return struct.unpack(">II", header[16:24])
+
+    @staticmethod
+    def get_size(surface):
+        """
+        Identify the memory footprint of the surface. Subsurfaces share
+        the pixels of their parent, so they take no memory of their own.
+        :param surface: Surface to be measured.
+        :return: Size in bytes.
+        """
+        if surface.get_parent() is not None:
+            return 0
+        return surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+    def load(self, name, state=None):
+        """
+        Retrieve the converted surface for the art asset, loading
+        it from the disk if it is not cached yet.
+        :param name: Asset name.
+        :param state: Asset state (if any).
+        :return: Shared surface of the art asset.
+        """
+        key = self.get_key(name, state)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            # Mark the surface as the most recently used one
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        # Load the associated art asset
+        self.misses += 1
+        path = self.get_asset(name, state)
+        frame = None
+        if self.atlas is not None and self.decode:
+            frame = self.atlas.get(key)
+        if frame is not None:
+            surface = frame
+        elif self.decode:
+            surface = self.convert(pygame.image.load(path))
+        else:
+            surface = pygame.Surface(self.read_size(path), pygame.SRCALPHA)
+        self.store(key, surface)
+        return surface
+
+    def store(self, key, surface):
+        """
+        Add the surface to the cache as the most recently used one.
+        :param key: Asset key.
+        :param surface: Surface of the art asset.
+        """
+        previous = self.surfaces.pop(key, None)
+        if previous is not None:
+            self.size -= self.get_size(previous)
+        self.surfaces[key] = surface
+        self.size += self.get_size(surface)
+        self.evict()
+
+    def preload(self, keys=None, workers=None, progress=None):
+        """
+        Load the art assets up front so that the gameplay never hits the
+        disk. Image files are decoded in parallel, while the conversion
+        for the display is finished on the main thread.
+        :param keys: Asset keys to be loaded (all the discovered assets by default).
+        :param workers: Number of the worker threads (chosen by the pool by default).
+        :param progress: Callable invoked with the number of decoded and total images.
+        :return: Timing report as a dictionary.
+        """
+        start = time.perf_counter()
+        if keys is None:
+            keys = self.discover()
+        # Skip the assets that are already cached or packed in the atlas
+        missing = []
+        for key in keys:
+            if key in self.surfaces:
+                continue
+            frame = self.atlas.get(key) if self.atlas is not None and self.decode else None
+            if frame is not None:
+                self.store(key, frame)
+            else:
+                missing.append(key)
+
+        # Decode the image files in parallel
+        paths = [self.get_asset(x) for x in missing]
+        if self.decode:
+            images = self.decode_files(paths, workers, progress)
+        else:
+            images = [pygame.Surface(self.read_size(x), pygame.SRCALPHA) for x in paths]
+        decoded = time.perf_counter()
+
+        # Conversion for the display has to happen on the main thread
+        for (key, image) in zip(missing, images):
+            self.store(key, self.convert(image) if self.decode else image)
+        self.misses += len(missing)
+        end = time.perf_counter()
+        return {
+            "assets": len(keys),
+            "decoded": len(missing) if self.decode else 0,
+            "decode": decoded - start,
+            "convert": end - decoded,
+            "total": end - start,
+        }
+
+    def evict(self):
+        """
+        Drop the least recently used surfaces until the cache fits
+        into its budget. The most recent surface is always kept.
+        """
+        while self.size > self.budget and len(self.surfaces) > 1:
+            (key, surface) = self.surfaces.popitem(last=False)
+            self.size -= self.get_size(surface)
+
+    def use_atlas(self, atlas):
+        """
+        Take the frames from the texture atlas instead of separate files.
+        The atlas pages stay in memory, so they are charged against the
+        budget once, while the frames cut out of them are free.
+        :param atlas: Texture atlas (None to load the files separately).
+        """
+        self.atlas = atlas
+        self.clear()
+
+    def clear(self):
+        """
+        Drop all the cached surfaces and reset the statistics.
+        """
+        self.surfaces.clear()
+        self.size = sum(self.get_size(x) for x in self.atlas.pages) if self.atlas is not None else 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        """
+        Retrieve the cache statistics.
+        :return: Dictionary with hits, misses, number of entries and size in bytes.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.surfaces),
+            "size": self.size,
+        }
+
+
+class TextureAtlas:
+    """
+    Class that defines a texture atlas packing all the art assets
+    into a few large pages. Frames are looked up by the asset name
+    (following the Name-State scheme) and returned as subsurfaces
+    of the pages. Packed pages are cached on the disk and reused
+    for as long as the art assets do not change.
+    """
+    # Size of a single atlas page
+    PAGE_SIZE = (1024, 1024)
+    # Version of the cached atlas format
+    VERSION = 1
+
+    def __init__(self, directory="../assets/", page_size=PAGE_SIZE):
+        """
+        Create a new empty texture atlas.
+        :param directory: Directory with the art assets.
+        :param page_size: Size of a single atlas page.
+        :return: Texture atlas without any frames.
+        """
+        self.directory = directory
+        self.page_size = page_size
+        self.pages = []
+        # Page index and area of every frame
+        self.frames = {}
+        # Subsurfaces that were already handed out
+        self.subsurfaces = {}
+
+    def get_cache(self):
+        """
+        Identify the relative path to the cached atlas.
+        :return: Path as a string.
+        """
+        return os.path.join(self.directory, ".cache", "atlas")
+
+    def get_sources(self):
+        """
+        Discover all the art assets along with their sizes and timestamps.
+        :return: Sorted list of file name, size and modification time.
+        """
+        sources = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".png"):
+                info = os.stat(os.path.join(self.directory, name))
+                sources.append([name, info.st_size, info.st_mtime_ns])
+        return sources
+
+    def get(self, key):
+        """
+        Retrieve the frame of the art asset.
+        :param key: Asset name such as Tin-StandingRight.
+        :return: Subsurface of the atlas page or None if there is no such frame.
+        """
+        frame = self.subsurfaces.get(key)
+        if frame is None and key in self.frames:
+            (page, area) = self.frames[key]
+            frame = self.pages[page].subsurface(pygame.Rect(area))
+            self.subsurfaces[key] = frame
+        return frame
+
+    def build(self, images=None):
+        """
+        Pack the art assets into the atlas pages. Frames are sorted by
+        height and placed on shelves, opening a new page once full.
+        :param images: Dictionary of asset name to its decoded surface
+                       (all the assets are loaded from the disk by default).
+        """
+        if images is None:
+            names = [x[0] for x in self.get_sources()]
+            surfaces = AssetCache.decode_files([os.path.join(self.directory, x) for x in names])
+            images = dict((x[:-4], y) for (x, y) in zip(names, surfaces))
+
+        self.pages = []
+        self.frames = {}
+        self.subsurfaces = {}
+        (page_width, page_height) = self.page_size
+        shelves = []
+        ordered = sorted(images.items(), key=lambda x: (-x[1].get_height(), x[0]))
+        for (key, image) in ordered:
+            (width, height) = image.get_size()
+            # Find the first shelf with enough space
+            for shelf in shelves:
+                (page, y, shelf_height, x) = shelf
+                if height <= shelf_height and x + width <= page_width:
+                    shelf[3] += width
+                    break
+            else:
+                # Open a new shelf below the last one or on a new page
+                (page, y) = (len(self.pages) - 1, 0)
+                if len(shelves) > 0 and shelves[-1][0] == page:
+                    y = shelves[-1][1] + shelves[-1][2]
+                if page < 0 or y + height > page_height or width > page_width:
+                    size = (max(page_width, width), max(page_height, height))
+                    self.pages.append(pygame.Surface(size, pygame.SRCALPHA))
+                    (page, y) = (len(self.pages) - 1, 0)
+                (x, shelf) = (0, [page, y, height, width])
+                shelves.append(shelf)
+            self.frames[key] = (page, (x, y, width, height))
+
+        # Copy the pixels over (maximum with transparent black keeps them intact)
+        for (key, image) in images.items():
+            (page, area) = self.frames[key]
+            if not image.get_flags() & pygame.SRCALPHA:
+                # Opaque images become fully opaque frames
+                source = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+                source.blit(image, (0, 0))
+                image = source
+            self.pages[page].blit(image, area[:2], special_flags=pygame.BLEND_RGBA_MAX)
+        self.pages = [asset_cache.convert(x) for x in self.pages]
+
+    def save(self):
+        """
+        Store the packed pages and the frame index in the cache.
+        Failures to store the atlas are not fatal.
+        """
+        path = self.get_cache()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            for (index, page) in enumerate(self.pages):
+                pygame.image.save(page, "%s-%d.png" % (path, index))
+            index = {
+                "version": TextureAtlas.VERSION,
+                "sources": self.get_sources(),
+                "pages": len(self.pages),
+                "frames": self.frames,
+            }
+            with open(path + ".json.tmp", "w") as file:
+                json.dump(index, file)
+            os.replace(path + ".json.tmp", path + ".json")
+        except (OSError, pygame.error):
+            pass
+
+    def load(self):
+        """
+        Load the packed pages from the cache if they are up to date.
+        :return: True if the atlas was loaded, false otherwise.
+        """
+        path = self.get_cache()
+        try:
+            with open(path + ".json", "r") as file:
+                index = json.load(file)
+            if index["version"] != TextureAtlas.VERSION or index["sources"] != self.get_sources():
+                return False
+            pages = [pygame.image.load("%s-%d.png" % (path, x)) for x in range(index["pages"])]
+        except (OSError, ValueError, KeyError, pygame.error):
+            return False
+        self.pages = [asset_cache.convert(x) for x in pages]
+        self.frames = dict((key, (page, tuple(area))) for (key, (page, area)) in index["frames"].items())
+        self.subsurfaces = {}
+        return True
+
+    @staticmethod
+    def create(directory="../assets/"):
+        """
+        Load the cached atlas or build a new one and cache it.
+        :param directory: Directory with the art assets.
+        :return: Texture atlas with all the art assets packed.
+        """
+        atlas = TextureAtlas(directory)
+        if not atlas.load():
+            atlas.build()
+            atlas.save()
+        return atlas
+
+
+# Cache shared by all the sprites in the game
+asset_cache = AssetCache()
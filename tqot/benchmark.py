@@ -0,0 +1,185 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+# Render without a window so that the benchmarks run on headless machines
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+# Keep the standard output to the JSON report only
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+from tqot.environment import *
+
+# Numbers of monsters that every benchmark is run with
+MONSTER_COUNTS = (1, 10, 100, 1000)
+# Size of the screen the level is rendered to
+SIZE = (1000, 480)
+
+
+def measure(action, iterations, repeats=5, setup=None):
+    """
+    Measure the time an action takes.
+    :param action: Callable to be measured.
+    :param iterations: Number of calls in a single repeat.
+    :param repeats: Number of repeats (the fastest one is reported).
+    :param setup: Callable invoked before every call (not measured).
+    :return: Time per call in microseconds.
+    """
+    best = None
+    for repeat in range(repeats):
+        elapsed = 0
+        for iteration in range(iterations):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            action()
+            elapsed += time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / iterations * 1e6
+
+
+def create_level(monsters):
+    """
+    Create a level populated with the given number of monsters.
+    :param monsters: Number of monsters.
+    :return: Level.
+    """
+    level = Level("SkyLand")
+    while len(level.monsters) < monsters:
+        level.create_monster()
+    return level
+
+
+def run_benchmarks(iterations):
+    """
+    Run all the benchmarks.
+    :param iterations: Number of calls per repeat for the cheap benchmarks.
+    :return: Dictionary of benchmark name to the times per monster count.
+    """
+    screen = pygame.display.get_surface()
+    results = {}
+
+    def record(name, count, value):
+        results.setdefault(name, {})[str(count)] = round(value, 3)
+
+    for count in MONSTER_COUNTS:
+        level = create_level(count)
+
+        # Level definition parsing and level construction
+        record("level_reader", count, measure(lambda: LevelReader("SkyLand"), max(1, iterations // 10)))
+        record("level_init", count, measure(lambda: create_level(count), 1, repeats=3))
+
+        # Asset reloading from the cache and from the disk
+        monster = next(iter(level.monsters))
+        record("reload_asset", count, measure(monster.reload_asset, iterations))
+        record("reload_asset_cold", count, measure(monster.reload_asset, max(1, iterations // 10),
+                                                   setup=asset_cache.clear))
+
+        # HUD updates with the health and time changing on every call
+        tower = level.tower
+        health = level.tower_health
+        record("health_indicator_update", count, measure(health.update, iterations,
+                                                         setup=lambda: setattr(tower, "current", tower.current - 0.1)))
+        tower.set_health(Tower.MAXIMUM_HEALTH, Tower.MAXIMUM_HEALTH)
+        indicator = level.time_indicator
+        times = itertools.cycle(["%02d:%02d" % (x // 60, x % 60) for x in range(3600)])
+        record("time_indicator_update", count, measure(indicator.update, iterations,
+                                                       setup=lambda: setattr(indicator, "time", next(times))))
+
+        # Animations of as many characters as there are monsters
+        clock = SimulationClock()
+        characters = [Tin(clock=clock) for x in range(count)]
+
+        def animate():
+            clock.tick()
+            for character in characters:
+                character.animate(character.runRight)
+        record("animation_play", count, measure(animate, max(1, iterations // 10)))
+
+        # Simulation step including collisions and sprite updates
+        level = create_level(count)
+        record("level_update", count, measure(level.update, max(1, iterations // 10)))
+
+        # Drawing the whole level on the screen
+        record("level_draw", count, measure(lambda: (level.clear(screen, level.background), level.draw(screen)),
+                                            max(1, iterations // 10)))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results with the baseline.
+    :param results: Benchmark results.
+    :param baseline: Baseline results.
+    :param tolerance: Allowed relative slowdown.
+    :return: List of the regressions as tuples of name, count, baseline and result.
+    """
+    regressions = []
+    for (name, times) in sorted(results.items()):
+        for (count, value) in sorted(times.items(), key=lambda x: int(x[0])):
+            reference = baseline.get(name, {}).get(count)
+            if reference is None:
+                continue
+            ratio = value / reference if reference > 0 else 1
+            print("%-24s %5s monsters %12.3f us %12.3f us %7.2fx" % (name, count, reference, value, ratio),
+                  file=sys.stderr)
+            if ratio > 1 + tolerance:
+                regressions.append((name, count, reference, value))
+    return regressions
+
+
+if __name__ == "__main__":
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Microbenchmarks of The Quest of Tin engine")
+    parser.add_argument("--iterations", type=int, default=200, help="number of calls per repeat")
+    parser.add_argument("--output", help="file to write the results to (standard output by default)")
+    parser.add_argument("--baseline", help="baseline to compare against (benchmark_baseline.json by default)")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    # Assets are located relatively to the game directory
+    directory = os.path.dirname(os.path.abspath(__file__))
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline or os.path.join(directory, "benchmark_baseline.json"))
+    os.chdir(directory)
+    pygame.init()
+    pygame.display.set_mode(SIZE)
+
+    report = {
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "results": run_benchmarks(args.iterations),
+    }
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.save_baseline:
+        with open(baseline_path, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    elif not os.path.exists(baseline_path):
+        # Timings are machine-specific, so the baseline is recorded on the machine that is checked
+        print("No baseline to compare against at %s, record one with --save-baseline" % baseline_path,
+              file=sys.stderr)
+        sys.exit(2)
+    else:
+        with open(baseline_path, "r") as file:
+            baseline = json.load(file)
+        if (baseline.get("python"), baseline.get("pygame"), baseline.get("machine")) != \
+                (report["python"], report["pygame"], report["machine"]):
+            print("Baseline was recorded with a different Python, PyGame or machine", file=sys.stderr)
+        regressions = compare(report["results"], baseline["results"], args.tolerance)
+        for (name, count, reference, value) in regressions:
+            print("Regression in %s with %s monsters: %.3f us -> %.3f us" % (name, count, reference, value),
+                  file=sys.stderr)
+        sys.exit(1 if regressions else 0)
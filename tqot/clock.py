@@ -0,0 +1,53 @@
+import pygame.time
+
+
+class SimulationClock:
+    """
+    Class that defines the clock of the game simulation. Time
+    advances in fixed steps, one per simulated frame, and does
+    not depend on the wall-clock time, so the game can be
+    simulated faster than real time with identical results.
+    """
+    # Duration of a single step in milliseconds (60 steps/sec)
+    STEP = 1000 / 60
+
+    def __init__(self, step=STEP):
+        """
+        Create a new simulation clock.
+        :param step: Duration of a single step in milliseconds.
+        :return: Clock at zero ticks.
+        """
+        self.step = step
+        # Number of steps taken so far
+        self.frame = 0
+        # Milliseconds elapsed so far
+        self.ticks = 0
+
+    def tick(self):
+        """
+        Advance the clock by a single step.
+        """
+        self.frame += 1
+        # Derive the time from the step count to avoid accumulating errors
+        self.ticks = self.frame * self.step
+
+    def get_ticks(self):
+        """
+        Retrieve the simulated time.
+        :return: Milliseconds elapsed since the clock was started.
+        """
+        return self.ticks
+
+
+class WallClock:
+    """
+    Class that defines a clock reading the wall-clock time from
+    pygame. Used by the animations that are not bound to a level.
+    """
+
+    def get_ticks(self):
+        """
+        Retrieve the wall-clock time.
+        :return: Milliseconds elapsed since pygame was initialised.
+        """
+        return pygame.time.get_ticks()
@@ -0,0 +1,189 @@
+import collections
+import pygame
+import pygame.key
+
+
+# Actions that the characters can take (combined as bit flags)
+ATTACK = 1
+LEFT = 2
+RIGHT = 4
+JUMP = 8
+
+
+class InputSnapshot:
+    """
+    Class that defines the state of the input devices in a single
+    frame. The snapshot is taken once per frame and handed to all
+    the controllers, so the devices are never polled separately.
+    """
+
+    def __init__(self, pressed=None):
+        """
+        Create a new input snapshot.
+        :param pressed: Pressed state of the keys indexed by the key code
+                        (nothing is pressed by default).
+        :return: Input snapshot.
+        """
+        self.pressed = pressed if pressed is not None else collections.defaultdict(bool)
+
+    @staticmethod
+    def capture():
+        """
+        Take the snapshot of the keyboard.
+        :return: Input snapshot.
+        """
+        return InputSnapshot(pygame.key.get_pressed())
+
+    @staticmethod
+    def from_keys(keys):
+        """
+        Create the snapshot with the given keys pressed.
+        :param keys: Key codes of the pressed keys.
+        :return: Input snapshot.
+        """
+        pressed = collections.defaultdict(bool)
+        for key in keys:
+            pressed[key] = True
+        return InputSnapshot(pressed)
+
+    def is_pressed(self, key):
+        """
+        Identify whether the key is pressed.
+        :param key: Key code.
+        :return: True if the key is pressed, false otherwise.
+        """
+        return bool(self.pressed[key])
+
+
+class Controller:
+    """
+    Class that defines a controller of a character. Controllers
+    translate the input snapshot of every simulation step into
+    the actions the character takes.
+    """
+
+    def get_actions(self, snapshot):
+        """
+        Identify the actions to be taken in the simulation step.
+        :param snapshot: Input snapshot of the frame.
+        :return: Actions as bit flags.
+        """
+        return 0
+
+
+class KeyboardController(Controller):
+    """
+    Class that defines a controller binding the keys to the actions.
+    """
+
+    def __init__(self, attack, left, right, jump):
+        """
+        Create a new keyboard controller.
+        :param attack: Key code of the attack action.
+        :param left: Key code of the left movement.
+        :param right: Key code of the right movement.
+        :param jump: Key code of the jump action.
+        :return: Keyboard controller.
+        """
+        self.bindings = ((attack, ATTACK), (left, LEFT), (right, RIGHT), (jump, JUMP))
+
+    @staticmethod
+    def create(alt_style=False):
+        """
+        Create the keyboard controller with the default control scheme.
+        :param alt_style: Whether the scheme of the second player is used.
+        :return: Keyboard controller.
+        """
+        if not alt_style:
+            return KeyboardController(pygame.K_RALT, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP)
+        return KeyboardController(pygame.K_LCTRL, pygame.K_a, pygame.K_d, pygame.K_w)
+
+    def get_actions(self, snapshot):
+        actions = 0
+        for (key, action) in self.bindings:
+            if snapshot.is_pressed(key):
+                actions |= action
+        return actions
+
+
+class ActionController(Controller):
+    """
+    Class that defines a controller taking the actions that were
+    set from the outside, such as by an agent or over the network.
+    The actions are held until they are changed.
+    """
+
+    def __init__(self, actions=0):
+        """
+        Create a new action controller.
+        :param actions: Initial actions as bit flags.
+        :return: Action controller.
+        """
+        self.actions = actions
+
+    def get_actions(self, snapshot):
+        return self.actions
+
+
+class ScriptedController(Controller):
+    """
+    Class that defines a bot following a script of the actions.
+    The script is a sequence of steps, each holding the actions
+    for the given number of simulation steps, and is repeated
+    once finished (unless told otherwise).
+    """
+
+    def __init__(self, script, loop=True):
+        """
+        Create a new scripted controller.
+        :param script: Sequence of tuples of the actions and the number of steps.
+        :param loop: Whether the script is repeated once finished.
+        :return: Scripted controller at the start of the script.
+        """
+        self.script = list(script)
+        self.loop = loop
+        # Position in the script
+        self.index = 0
+        self.remaining = self.script[0][1] if len(self.script) > 0 else 0
+
+    def get_actions(self, snapshot):
+        # Move on to the next step of the script
+        while self.remaining <= 0:
+            if self.index + 1 >= len(self.script):
+                if not self.loop or len(self.script) == 0:
+                    return 0
+                self.index = -1
+            self.index += 1
+            self.remaining = self.script[self.index][1]
+        self.remaining -= 1
+        return self.script[self.index][0]
+
+
+class ReplayController(Controller):
+    """
+    Class that defines a controller replaying the recorded actions,
+    one per simulation step. Nothing is done once the recording ends.
+    """
+
+    def __init__(self, actions):
+        """
+        Create a new replay controller.
+        :param actions: Sequence of the recorded actions.
+        :return: Replay controller at the start of the recording.
+        """
+        self.actions = actions
+        # Index of the next simulation step
+        self.step = 0
+
+    def is_finished(self):
+        """
+        Identify whether the whole recording has been replayed.
+        :return: True if finished, false otherwise.
+        """
+        return self.step >= len(self.actions)
+
+    def get_actions(self, snapshot):
+        if self.is_finished():
+            return 0
+        self.step += 1
+        return self.actions[self.step - 1]
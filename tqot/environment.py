@@ -1,20 +1,114 @@
+import collections
+import concurrent.futures
+import hashlib
 import math
+import mmap
+import os
 import pygame
 import pygame.sprite
-import time
+import string
+import struct
+import tempfile
+from tqot.profiler import *
 from tqot.sprites import *
 
 
+class LevelRows:
+    """
+    Class that defines a read-only sequence of the level rows
+    stored in a compiled level. Rows are decoded from the memory
+    map on access, so opening a level does not depend on its size.
+    """
+    # Row offset in the run table
+    OFFSET = struct.Struct("<I")
+    # Run as the slot, size and index of the platform name
+    RUN = struct.Struct("<IIH")
+
+    def __init__(self, buffer, offset, count, names):
+        """
+        Create a new view of the level rows.
+        :param buffer: Buffer with the compiled level.
+        :param offset: Offset of the row offset table in the buffer.
+        :param count: Number of rows.
+        :param names: Platform names referenced by the runs.
+        :return: Sequence of the level rows.
+        """
+        self.buffer = buffer
+        self.offsets = offset
+        self.runs = offset + LevelRows.OFFSET.size * (count + 1)
+        self.count = count
+        self.names = names
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("Level row index out of range")
+        # Identify the runs of the row
+        (start,) = LevelRows.OFFSET.unpack_from(self.buffer, self.offsets + LevelRows.OFFSET.size * index)
+        (end,) = LevelRows.OFFSET.unpack_from(self.buffer, self.offsets + LevelRows.OFFSET.size * (index + 1))
+        # Decode the runs
+        row = []
+        for run in range(start, end):
+            (x, size, name) = LevelRows.RUN.unpack_from(self.buffer, self.runs + LevelRows.RUN.size * run)
+            row.append((x, size, self.names[name]))
+        return row
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def get_runs(self, index, start, end):
+        """
+        Decode only the runs of the row that overlap the range of slots.
+        Runs of a row are ordered and do not overlap, so the first one
+        is found with a binary search.
+        :param index: Index of the row.
+        :param start: First slot of the range.
+        :param end: Slot right after the range.
+        :return: List of the runs as tuples of the slot, size and platform name.
+        """
+        (first,) = LevelRows.OFFSET.unpack_from(self.buffer, self.offsets + LevelRows.OFFSET.size * index)
+        (last,) = LevelRows.OFFSET.unpack_from(self.buffer, self.offsets + LevelRows.OFFSET.size * (index + 1))
+        # Find the first run that ends after the start of the range
+        (low, high) = (first, last)
+        while low < high:
+            middle = (low + high) // 2
+            (x, size, name) = LevelRows.RUN.unpack_from(self.buffer, self.runs + LevelRows.RUN.size * middle)
+            if x + size <= start:
+                low = middle + 1
+            else:
+                high = middle
+        # Decode the runs until the end of the range
+        row = []
+        for run in range(low, last):
+            (x, size, name) = LevelRows.RUN.unpack_from(self.buffer, self.runs + LevelRows.RUN.size * run)
+            if x >= end:
+                break
+            row.append((x, size, self.names[name]))
+        return row
+
+
 class LevelReader:
     """
     Class that enables the game to read in and interpret
-    the level definition file.
+    the level definition file. The interpreted level is
+    compiled into a binary file stored beside the definition,
+    which is memory-mapped instead of parsing the text again
+    for as long as the definition does not change.
     """
     BACKGROUND = 0
     GROUND_LEVEL = 1
     PLATFORMS = 2
     LEVEL = 3
     EXIT = 4
+    # Compiled level header: signature, version, definition size, mtime and hash
+    MAGIC = b"TQLC"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHQQ20s")
 
     def __init__(self, name):
         """
@@ -29,10 +123,16 @@ class LevelReader:
         self.ground_level = ""
         self.platforms = {}
         self.level = []
+        # Width of the level in slots
+        self.columns = 0
         # Setup the default state of the reader
         self.state = LevelReader.BACKGROUND
-        # Read the level in
-        self.read()
+        # Memory map of the compiled level (if loaded)
+        self.mapping = None
+        # Load the compiled level or read the level in and compile it
+        if not self.load():
+            self.read()
+            self.compile()
 
     def read(self):
         """
@@ -67,6 +167,7 @@ class LevelReader:
                 if self.state == LevelReader.LEVEL:
                     # Get rid of side maps
                     line = line[1:-1]
+                    self.columns = max(self.columns, len(line))
                     level = []
                     platform = ""
                     size = 1
@@ -98,6 +199,172 @@ class LevelReader:
         """
         return "../assets/" + self.name + ".level"
 
+    def get_compiled_asset(self):
+        """
+        Identify the relative path to the compiled map.
+        :return: Path as a string.
+        """
+        return "../assets/" + self.name + ".levelc"
+
+    def get_runs(self, index, start, end):
+        """
+        Retrieve the runs of the row that overlap the range of slots.
+        :param index: Index of the row.
+        :param start: First slot of the range.
+        :param end: Slot right after the range.
+        :return: List of the runs as tuples of the slot, size and platform name.
+        """
+        if isinstance(self.level, LevelRows):
+            return self.level.get_runs(index, start, end)
+        return [x for x in self.level[index] if x[0] < end and x[0] + x[1] > start]
+
+    def get_source_hash(self):
+        """
+        Calculate the hash of the level definition.
+        :return: SHA-1 digest as bytes.
+        """
+        with open(self.get_asset(), "rb") as file:
+            return hashlib.sha1(file.read()).digest()
+
+    @staticmethod
+    def pack_string(value):
+        """
+        Encode the string for the compiled level.
+        :param value: String to be encoded.
+        :return: Length-prefixed UTF-8 bytes.
+        """
+        data = value.encode("utf-8")
+        return struct.pack("<H", len(data)) + data
+
+    @staticmethod
+    def unpack_string(buffer, offset):
+        """
+        Decode the string from the compiled level.
+        :param buffer: Buffer with the compiled level.
+        :param offset: Offset of the string.
+        :return: Tuple of the string and the offset right after it.
+        """
+        (length,) = struct.unpack_from("<H", buffer, offset)
+        offset += 2
+        if offset + length > len(buffer):
+            raise struct.error("String reaches past the end of the buffer")
+        return bytes(buffer[offset:offset + length]).decode("utf-8"), offset + length
+
+    def compile(self):
+        """
+        Compile the interpreted level into the binary file. Failures
+        to store the compiled level are not fatal.
+        """
+        # Levels with a background that does not fit the compiled format are read from the text every time
+        if len(self.background) != 3 or not all(0 <= x <= 255 for x in self.background):
+            return
+        source = os.stat(self.get_asset())
+        # Platform names are stored once and referenced by index
+        names = sorted(set(self.platforms.values()))
+        indices = dict((name, index) for (index, name) in enumerate(names))
+
+        chunks = [LevelReader.HEADER.pack(LevelReader.MAGIC, LevelReader.VERSION, source.st_size,
+                                          source.st_mtime_ns, self.get_source_hash())]
+        chunks.append(struct.pack("<3B", *self.background))
+        chunks.append(self.pack_string(self.ground_level))
+        # Platform table
+        chunks.append(struct.pack("<H", len(self.platforms)))
+        for (symbol, name) in sorted(self.platforms.items()):
+            chunks.append(self.pack_string(symbol) + self.pack_string(name))
+        chunks.append(struct.pack("<H", len(names)))
+        for name in names:
+            chunks.append(self.pack_string(name))
+        # Row offsets followed by the runs
+        chunks.append(struct.pack("<II", self.columns, len(self.level)))
+        offset = 0
+        for row in self.level:
+            chunks.append(LevelRows.OFFSET.pack(offset))
+            offset += len(row)
+        chunks.append(LevelRows.OFFSET.pack(offset))
+        for row in self.level:
+            for (x, size, name) in row:
+                chunks.append(LevelRows.RUN.pack(x, size, indices[name]))
+
+        # Replace the compiled level atomically (through a file of its own, since other processes may compile too)
+        path = self.get_compiled_asset()
+        temporary = None
+        try:
+            (handle, temporary) = tempfile.mkstemp(".tmp", os.path.basename(path) + ".", os.path.dirname(path))
+            with os.fdopen(handle, "wb") as file:
+                file.write(b"".join(chunks))
+            os.replace(temporary, path)
+        except OSError:
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+
+    def load(self):
+        """
+        Load the compiled level if it is up to date with the definition.
+        :return: True if the compiled level was loaded, false otherwise.
+        """
+        try:
+            with open(self.get_compiled_asset(), "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        if not self.parse(buffer):
+            buffer.close()
+            return False
+        self.mapping = buffer
+        self.state = LevelReader.EXIT
+        return True
+
+    def parse(self, buffer):
+        """
+        Interpret the compiled level.
+        :param buffer: Buffer with the compiled level.
+        :return: True if the compiled level is valid and up to date, false otherwise.
+        """
+        try:
+            # Check that the compiled level matches the definition
+            (magic, version, size, mtime, digest) = LevelReader.HEADER.unpack_from(buffer, 0)
+            if magic != LevelReader.MAGIC or version != LevelReader.VERSION:
+                return False
+            source = os.stat(self.get_asset())
+            outdated = (size, mtime) != (source.st_size, source.st_mtime_ns)
+            if outdated and digest != self.get_source_hash():
+                return False
+
+            # Read the level properties
+            offset = LevelReader.HEADER.size
+            self.background = struct.unpack_from("<3B", buffer, offset)
+            (self.ground_level, offset) = self.unpack_string(buffer, offset + 3)
+            # Platform table
+            (count,) = struct.unpack_from("<H", buffer, offset)
+            offset += 2
+            platforms = {}
+            for index in range(count):
+                (symbol, offset) = self.unpack_string(buffer, offset)
+                (platforms[symbol], offset) = self.unpack_string(buffer, offset)
+            (count,) = struct.unpack_from("<H", buffer, offset)
+            offset += 2
+            names = []
+            for index in range(count):
+                (name, offset) = self.unpack_string(buffer, offset)
+                names.append(name)
+            # Rows are decoded lazily, so make sure that the offset and run tables are complete
+            (columns, count) = struct.unpack_from("<II", buffer, offset)
+            offset += 8
+            (runs,) = LevelRows.OFFSET.unpack_from(buffer, offset + LevelRows.OFFSET.size * count)
+            if len(buffer) != offset + LevelRows.OFFSET.size * (count + 1) + LevelRows.RUN.size * runs:
+                return False
+            self.columns = columns
+            self.platforms = platforms
+            self.level = LevelRows(buffer, offset, count, names)
+        except (struct.error, UnicodeDecodeError):
+            return False
+        # Definition was touched without changes, refresh the timestamp
+        if outdated:
+            self.level = list(self.level)
+            self.compile()
+        return True
+
 
 class EnvironmentSprite(pygame.sprite.Sprite):
     """
@@ -106,27 +373,21 @@ class EnvironmentSprite(pygame.sprite.Sprite):
     properties such as asset name.
     """
 
-    def __init__(self, name):
+    def __init__(self, name, image=None):
         """
         Create and initialise a new asset-based sprite.
         :param name: Asset name.
+        :param image: Already loaded art asset (loaded from the cache by default).
         :return: Initialised instance of the sprite.
         """
         # Store the asset name
         self.name = name
         # Load the associated art asset
-        self.image = pygame.image.load(self.get_asset()).convert_alpha()
+        self.image = image if image is not None else asset_cache.load(self.name)
         self.rect = self.image.get_rect()
         # Initialise the sprite
         super().__init__()
 
-    def get_asset(self):
-        """
-        Identify the relative path to the assets of the sprite.
-        :return: Path as a string.
-        """
-        return "../assets/" + self.name + ".png"
-
 
 class GroundLevel(pygame.sprite.Group):
     """
@@ -136,18 +397,17 @@ class GroundLevel(pygame.sprite.Group):
     ensure that characters do not fall below this level.
     """
 
-    def __init__(self, name):
+    def __init__(self, name, size=None):
         """
         Create a new ground level.
         :param name: Asset name.
+        :param size: Size of the world (defaults to the size of the display).
         :return: Initialised instance of the sprite group.
         """
         # Initialise the sprite group
         super().__init__()
         # Identify the size of the screen
-        surface = pygame.display.get_surface()
-        width = surface.get_width()
-        height = surface.get_height()
+        (width, height) = get_world_size(size)
         # Create and tile the sprites
         offset = 0
         while offset < width:
@@ -178,15 +438,16 @@ class Platform(EnvironmentSprite):
     # Size of the border for the art asset
     border = 4
 
-    def __init__(self, name, size):
+    def __init__(self, name, size, image=None):
         """
         Create a new platform.
         :param name: Asset name.
         :param size: Size of the platform.
+        :param image: Already loaded art asset (loaded from the cache by default).
         :return: Initialised instance of the sprite.
         """
         # Initialise the sprite
-        super().__init__(name)
+        super().__init__(name, image)
         # Determine the dimensions of the platform
         width = (self.rect.width - 2*self.border) * size + 2*self.border
         height = self.rect.height
@@ -204,11 +465,290 @@ class Platform(EnvironmentSprite):
         self.rect = asset.get_rect()
 
 
+class SpatialGrid:
+    """
+    Class that defines a uniform grid index for the static
+    sprites. Every sprite is registered in all the cells it
+    overlaps, so that the collision queries only need to check
+    the sprites sharing the cells with the queried one.
+    """
+
+    def __init__(self, cell_width, cell_height, sprites=()):
+        """
+        Create a new spatial grid.
+        :param cell_width: Width of a grid cell.
+        :param cell_height: Height of a grid cell.
+        :param sprites: Sprites to be indexed.
+        :return: Spatial grid with the sprites indexed.
+        """
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        # Sprites in each cell along with their insertion order
+        self.cells = {}
+        self.count = 0
+        for sprite in sprites:
+            self.add(sprite)
+
+    def get_cells(self, rect):
+        """
+        Identify the grid cells that the rectangle overlaps.
+        :param rect: Rectangle to be checked.
+        :return: Generator of the cell coordinates.
+        """
+        if rect.width <= 0 or rect.height <= 0:
+            return
+        for x in range(rect.left // self.cell_width, (rect.right - 1) // self.cell_width + 1):
+            for y in range(rect.top // self.cell_height, (rect.bottom - 1) // self.cell_height + 1):
+                yield (x, y)
+
+    def add(self, sprite, order=None):
+        """
+        Index the sprite in the grid.
+        :param sprite: Static sprite to be indexed.
+        :param order: Key the collisions are ordered by (the insertion order by default).
+        """
+        if order is None:
+            order = self.count
+        entry = (order, sprite)
+        self.count += 1
+        for cell in self.get_cells(sprite.rect):
+            self.cells.setdefault(cell, []).append(entry)
+
+    def remove(self, sprite):
+        """
+        Remove the sprite from the grid.
+        :param sprite: Indexed sprite that has not moved since it was indexed.
+        """
+        for cell in self.get_cells(sprite.rect):
+            entries = [x for x in self.cells.get(cell, ()) if x[1] is not sprite]
+            if len(entries) > 0:
+                self.cells[cell] = entries
+            else:
+                self.cells.pop(cell, None)
+
+    def collide(self, sprite):
+        """
+        Find the indexed sprites that collide with the given one.
+        :param sprite: Sprite to be checked.
+        :return: List of colliding sprites ordered by their keys.
+        """
+        found = {}
+        for cell in self.get_cells(sprite.rect):
+            for (order, other) in self.cells.get(cell, ()):
+                if order not in found and sprite.rect.colliderect(other.rect):
+                    found[order] = other
+        return [found[x] for x in sorted(found)]
+
+
+class LevelChunk:
+    """
+    Class that defines a fixed-width slice of the level. The chunk
+    owns the environment sprites starting within it, while its
+    background has all the environment overlapping it pre-baked.
+    """
+
+    def __init__(self, index, rect, sprites, background=None):
+        """
+        Create a new chunk.
+        :param index: Index of the chunk.
+        :param rect: Area of the world covered by the chunk.
+        :param sprites: List of the owned sprites along with their collision keys.
+        :param background: Pre-baked background of the chunk (None if headless).
+        :return: Level chunk.
+        """
+        self.index = index
+        self.rect = rect
+        self.sprites = sprites
+        self.background = background
+
+
+class ChunkStreamer:
+    """
+    Class that defines the streaming of the level environment in
+    fixed-width chunks. The chunks around the play area are built
+    and indexed for the collisions as it moves, while the ones next
+    to it are built ahead of time on a background thread (unless
+    headless). The art assets are resolved on the main thread up
+    front, so the background thread only lays out and blits the
+    surfaces. Only a bounded number of the least recently used
+    chunks is kept, so the level is never built as a whole. The
+    platforms must not be longer than a chunk.
+    """
+    # Width of a chunk in platform slots
+    WIDTH = 32
+    # Number of the built chunks that are kept
+    CAPACITY = 12
+
+    def __init__(self, definition, size, spacing, headless=False, capacity=CAPACITY):
+        """
+        Create a new streamer without any chunks built.
+        :param definition: Level reader with the level definition.
+        :param size: Size of the world.
+        :param spacing: Vertical distance between the platforms.
+        :param headless: Whether the chunks are built without a display and a background thread.
+        :param capacity: Number of the built chunks that are kept.
+        :return: Chunk streamer.
+        """
+        self.definition = definition
+        self.size = size
+        self.spacing = spacing
+        self.headless = headless
+        self.capacity = capacity
+        # Identify the dimensions of the chunks
+        self.slot_width = Platform.slot_width - 2*Platform.border
+        self.chunk_width = ChunkStreamer.WIDTH * self.slot_width
+        self.count = -(-size[0] // self.chunk_width)
+        # Ground level spans across the whole world
+        self.ground_tile = asset_cache.load(definition.ground_level)
+        self.ground_top = size[1] - self.ground_tile.get_height()
+        # Art assets of the platforms and the pixel format of the backgrounds
+        self.images = dict((x, asset_cache.load(x)) for x in set(definition.platforms.values()))
+        self.format = None if headless else pygame.Surface((1, 1)).convert()
+        # Static environment of the built chunks used for the collisions
+        self.grid = SpatialGrid(self.slot_width, spacing)
+        # Built chunks from the least recently used and the ones being built
+        self.chunks = collections.OrderedDict()
+        self.pending = {}
+        # Thread building the chunks ahead of time (None if headless)
+        self.executor = None if headless else concurrent.futures.ThreadPoolExecutor(1)
+
+    def get_indices(self, rect):
+        """
+        Identify the chunks that the rectangle overlaps.
+        :param rect: Rectangle in the world.
+        :return: Range of the chunk indices.
+        """
+        first = max(rect.left // self.chunk_width, 0)
+        last = min((rect.right - 1) // self.chunk_width, self.count - 1)
+        return range(first, last + 1)
+
+    def build(self, index):
+        """
+        Build the chunk. Neither the streamer nor the asset cache is
+        modified, so that the chunks can be built on the background thread.
+        :param index: Index of the chunk.
+        :return: Level chunk.
+        """
+        rect = pygame.Rect(index * self.chunk_width, 0, self.chunk_width, self.size[1])
+        # Sprites owned by the chunk and all the sprites overlapping it
+        sprites = []
+        overlapping = []
+        # Tile the ground level
+        tile_width = self.ground_tile.get_width()
+        for x in range(rect.left // tile_width * tile_width, min(rect.right, self.size[0]), tile_width):
+            sprite = EnvironmentSprite(self.definition.ground_level, self.ground_tile)
+            sprite.rect.x = x
+            sprite.rect.y = self.ground_top
+            overlapping.append(sprite)
+            if x >= rect.left:
+                sprites.append(((0, x), sprite))
+        # Create the platforms along with the ones reaching over from the neighbours
+        first = index * ChunkStreamer.WIDTH
+        for row in range(len(self.definition.level)):
+            y = self.ground_top - self.spacing * (row + 1)
+            for (x, size, name) in self.definition.get_runs(row, first - 1, first + ChunkStreamer.WIDTH + 1):
+                platform = Platform(name, size, self.images[name])
+                platform.rect.x = self.slot_width * x + Platform.border
+                platform.rect.y = y
+                overlapping.append(platform)
+                if first <= x < first + ChunkStreamer.WIDTH:
+                    sprites.append(((row + 1, x), platform))
+
+        # Pre-bake the environment into the chunk background
+        background = None
+        if not self.headless:
+            background = pygame.Surface(rect.size, 0, self.format)
+            background.fill(self.definition.background)
+            for sprite in overlapping:
+                background.blit(sprite.image, sprite.rect.move(-rect.x, -rect.y))
+        return LevelChunk(index, rect, sprites, background)
+
+    def install(self, chunk):
+        """
+        Index the sprites of the built chunk for the collisions.
+        :param chunk: Level chunk.
+        """
+        for (order, sprite) in chunk.sprites:
+            self.grid.add(sprite, order)
+        self.chunks[chunk.index] = chunk
+
+    def discard(self, index):
+        """
+        Remove the chunk along with its sprites.
+        :param index: Index of the built chunk.
+        """
+        chunk = self.chunks.pop(index)
+        for (order, sprite) in chunk.sprites:
+            self.grid.remove(sprite)
+
+    def require(self, rects, margin=0):
+        """
+        Make sure that the chunks overlapping the play area are built and
+        start building the ones next to them on the background thread.
+        :param rects: Rectangles of the play area.
+        :param margin: Horizontal distance by which the play area is grown.
+        """
+        needed = set()
+        for rect in rects:
+            needed.update(self.get_indices(rect.inflate(2 * margin, 0)))
+        # Index the chunks that have been built on the background thread
+        for (index, future) in list(self.pending.items()):
+            if future.done():
+                del self.pending[index]
+                if index not in self.chunks:
+                    self.install(future.result())
+        # Build the missing chunks, waiting for the ones already being built
+        for index in sorted(needed):
+            if index in self.chunks:
+                self.chunks.move_to_end(index)
+            elif index in self.pending:
+                self.install(self.pending.pop(index).result())
+            else:
+                self.install(self.build(index))
+        # Build the neighbours ahead of time
+        if self.executor is not None:
+            for index in needed:
+                for neighbour in (index - 1, index + 1):
+                    if 0 <= neighbour < self.count and neighbour not in self.chunks and \
+                            neighbour not in self.pending and neighbour not in needed:
+                        self.pending[neighbour] = self.executor.submit(self.build, neighbour)
+        # Discard the least recently used chunks
+        while len(self.chunks) > self.capacity:
+            index = next((x for x in self.chunks if x not in needed), None)
+            if index is None:
+                break
+            self.discard(index)
+
+    def close(self):
+        """
+        Stop building the chunks ahead of time and drop the ones being built.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.pending = {}
+
+    def compose(self, surface, origin):
+        """
+        Paint the background of the area of the world on the surface.
+        :param surface: Surface to paint on.
+        :param origin: Position of the surface in the world.
+        """
+        area = surface.get_rect().move(origin)
+        self.require([area])
+        surface.fill(self.definition.background)
+        for index in self.get_indices(area):
+            chunk = self.chunks[index]
+            surface.blit(chunk.background, (chunk.rect.x - origin[0], chunk.rect.y - origin[1]))
+
+
 class Tower(EnvironmentSprite, Damageable):
     """
     Class that defines and the main tower that the character
     is supposed to protect. Aligns the sprite in the middle
     and tracks the damage levels to change the state accordingly.
+    All the damage stages are preloaded, so that the appearance
+    is swapped only when the health crosses a stage boundary.
     """
     ASSET_NAME = "Tower"
     STATE_INITIAL = "Initial"
@@ -216,48 +756,57 @@ class Tower(EnvironmentSprite, Damageable):
     STATE_RUINED = "Ruined"
     MAXIMUM_HEALTH = 100
 
-    def __init__(self):
+    def __init__(self, width=None):
         """
         Create a new Tower.
+        :param width: Width of the world (defaults to the width of the display).
         :return: Tower sprite.
         """
+        # Preload all the damage stages of the tower
+        self.stages = {}
+        for state in (Tower.STATE_INITIAL, Tower.STATE_DAMAGED, Tower.STATE_RUINED):
+            self.stages[state] = asset_cache.load(Tower.ASSET_NAME + "-" + state)
         # Initialise the tower
-        self.state = ""
-        self.set_state(Tower.STATE_INITIAL)
+        self.state = Tower.STATE_INITIAL
+        super().__init__(Tower.ASSET_NAME + "-" + self.state)
         # Identify the size of the screen
-        surface = pygame.display.get_surface()
-        width = surface.get_width()
+        if width is None:
+            (width, height) = get_world_size()
         # Position the tower in the middle vertically
         self.rect.centerx = width / 2
         # Initialise the logic
         self.set_health(Tower.MAXIMUM_HEALTH, Tower.MAXIMUM_HEALTH)
+        # Health version that the current state was chosen for
+        self.state_version = self.health_version
 
     def set_state(self, state):
         """
         Update the tower state.
         :param state: New state.
         """
-        # Set the state of the tower
+        if self.state == state:
+            return
+        # Swap the appearance of the tower in place
         self.state = state
-        # Reinitialise the sprite
-        super().__init__(Tower.ASSET_NAME + '-' + self.state)
-
-    def update(self):
-        # Identify previous location
-        x = self.rect.x
-        y = self.rect.y
+        self.image = self.stages[state]
+        self.rect.size = self.image.get_size()
 
-        # Update the state based on current tower health
+    def get_stage(self):
+        """
+        Identify the damage stage based on current tower health.
+        :return: State that corresponds to the tower health.
+        """
         if self.current > self.maximum * 2/3:
-            self.set_state(Tower.STATE_INITIAL)
+            return Tower.STATE_INITIAL
         elif self.current > self.maximum * 1/3:
-            self.set_state(Tower.STATE_DAMAGED)
-        else:
-            self.set_state(Tower.STATE_RUINED)
+            return Tower.STATE_DAMAGED
+        return Tower.STATE_RUINED
 
-        # Restore previous position
-        self.rect.x = x
-        self.rect.y = y
+    def update(self):
+        # Update the state only when tower health has changed
+        if self.health_version != self.state_version:
+            self.state_version = self.health_version
+            self.set_state(self.get_stage())
 
         # Base update routine
         super().update()
@@ -267,10 +816,15 @@ class HealthIndicator(EnvironmentSprite):
     """
     Class that defines the health indicator for the damageable
     creature in the game. Tiles the red and black hearts to display
-    the current and maximum health.
+    the current and maximum health. Rendered bars are cached and
+    the indicator is redrawn only when the creature health changes.
     """
     ASSET_NAME = "Life"
     ALT_ASSET_NAME = "Death"
+    # Rendered bars shared by all the indicators
+    bars = collections.OrderedDict()
+    # Maximum number of the rendered bars to keep
+    bars_limit = 256
 
     def __init__(self, parent):
         """
@@ -278,7 +832,13 @@ class HealthIndicator(EnvironmentSprite):
         :param parent: Parent damageable creature.
         :return: Health indicator sprite.
         """
+        # Initialise the sprite
+        super().__init__(HealthIndicator.ALT_ASSET_NAME)
+        self.death = self.image
+        self.life = asset_cache.load(HealthIndicator.ASSET_NAME)
+        # Health version of the parent that is currently displayed
         self.parent = parent
+        self.version = None
         self.rect = pygame.Rect(0, 0, 0, 0)
 
     def set_health(self, current, maximum):
@@ -287,55 +847,137 @@ class HealthIndicator(EnvironmentSprite):
         :param current: Current creature health.
         :param maximum: Maximum creature health.
         """
-        # Initialise the sprite
-        super().__init__(HealthIndicator.ALT_ASSET_NAME)
+        # Health is displayed with the precision of a single pixel
+        filled = int(self.life.get_width() * max(current, 0) / 10)
+        key = (filled, maximum)
+        asset = HealthIndicator.bars.get(key)
+        if asset is None:
+            asset = self.render(filled, maximum)
+            HealthIndicator.bars[key] = asset
+            if len(HealthIndicator.bars) > HealthIndicator.bars_limit:
+                HealthIndicator.bars.popitem(last=False)
+
+        # Set the cached asset as appearance for the sprite
+        self.image = asset
+        self.rect.size = asset.get_size()
 
+    def render(self, filled, maximum):
+        """
+        Render the health bar.
+        :param filled: Width of the current health in pixels.
+        :param maximum: Maximum creature health.
+        :return: Surface with the health bar.
+        """
+        (tile_width, tile_height) = self.death.get_size()
         # Identify the number of sprites to be displayed
         count = int(maximum / 10)
         # Determine the dimensions of the indicator
-        width = self.rect.width * count
-        height = self.rect.height
-        asset = pygame.Surface((width, height), pygame.SRCALPHA)
+        asset = pygame.Surface((tile_width * count, tile_height), pygame.SRCALPHA)
         # Tile the death asset
         for x in range(count):
-            asset.blit(self.image, (self.rect.width * x, 0), (0, 0, self.rect.width, self.rect.height))
+            asset.blit(self.death, (tile_width * x, 0))
 
-        # Initialise the sprite
-        super().__init__(HealthIndicator.ASSET_NAME)
-        # Identify the number of sprites to be displayed
-        count = int(current / 10)
         # Tile the whole life asset
+        count = filled // tile_width
         for x in range(count):
-            asset.blit(self.image, (self.rect.width * x, 0), (0, 0, self.rect.width, self.rect.height))
+            asset.blit(self.life, (tile_width * x, 0))
         # Draw the partial life asset
-        partial_offset = self.rect.width * count
-        partial_width = self.rect.width * (current % 10) / 10
-        asset.blit(self.image, (partial_offset, 0), (0, 0, partial_width, self.rect.height))
-
-        # Set the generated asset as appearance for the sprite
-        self.image = asset
-        self.rect = asset.get_rect()
+        partial_width = filled % tile_width
+        asset.blit(self.life, (tile_width * count, 0), (0, 0, partial_width, tile_height))
+        return asset
 
     def update(self):
-        # Identify previous location
-        x = self.rect.x
-        y = self.rect.y
-
-        # Update creature health
-        self.set_health(self.parent.current, self.parent.maximum)
-
-        # Restore previous position
-        self.rect.x = x
-        self.rect.y = y
+        # Redraw only when creature health has changed
+        if self.version != self.parent.health_version:
+            self.version = self.parent.health_version
+            self.set_health(self.parent.current, self.parent.maximum)
 
         # Base update routine
         super().update()
 
 
+class GlyphAtlas:
+    """
+    Class that defines a pre-rendered atlas of the font glyphs.
+    Text made of the known characters is composed from the atlas
+    instead of being rendered by the font every time. Atlases are
+    built once per font, size, colour and anti-aliasing mode.
+    """
+    # Characters used by the timers and the scores
+    CHARACTERS = "0123456789:. "
+    # Atlases shared across the game
+    atlases = {}
+
+    def __init__(self, font, color, antialias=False, characters=CHARACTERS):
+        """
+        Create a new glyph atlas.
+        :param font: Font to render the glyphs with.
+        :param color: Colour of the glyphs.
+        :param antialias: Whether the glyphs should be anti-aliased.
+        :param characters: Characters to be pre-rendered.
+        :return: Glyph atlas with all the characters rendered.
+        """
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        # Render the glyphs and measure their advances
+        glyphs = [asset_cache.convert(font.render(x, antialias, color)) for x in characters]
+        width = sum(glyph.get_width() for glyph in glyphs)
+        self.height = max(glyph.get_height() for glyph in glyphs)
+        # Pack the glyphs next to each other
+        self.image = pygame.Surface((width, self.height), pygame.SRCALPHA)
+        self.glyphs = {}
+        offset = 0
+        for (character, glyph) in zip(characters, glyphs):
+            self.image.blit(glyph, (offset, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            area = pygame.Rect(offset, 0, glyph.get_width(), glyph.get_height())
+            self.glyphs[character] = (area, font.size(character)[0])
+            offset += glyph.get_width()
+
+    @staticmethod
+    def get(name, size, color, antialias=False, characters=CHARACTERS):
+        """
+        Retrieve the shared atlas for the system font.
+        :param name: Name of the system font.
+        :param size: Size of the font.
+        :param color: Colour of the glyphs.
+        :param antialias: Whether the glyphs should be anti-aliased.
+        :param characters: Characters to be pre-rendered.
+        :return: Glyph atlas.
+        """
+        key = (name, size, color, antialias, characters)
+        atlas = GlyphAtlas.atlases.get(key)
+        if atlas is None:
+            font = pygame.font.SysFont(name, size)
+            atlas = GlyphAtlas(font, color, antialias, characters)
+            GlyphAtlas.atlases[key] = atlas
+        return atlas
+
+    def render(self, text):
+        """
+        Compose the text from the pre-rendered glyphs.
+        :param text: Text to be composed.
+        :return: Surface with the text.
+        """
+        # Fall back to the font for the unknown characters
+        if any(x not in self.glyphs for x in text):
+            return asset_cache.convert(self.font.render(text, self.antialias, self.color))
+        # Compose the text glyph by glyph
+        width = sum(self.glyphs[x][1] for x in text)
+        label = pygame.Surface((width, self.height), pygame.SRCALPHA)
+        offset = 0
+        for x in text:
+            (area, advance) = self.glyphs[x]
+            label.blit(self.image, (offset, 0), area, special_flags=pygame.BLEND_RGBA_MAX)
+            offset += advance
+        return label
+
+
 class TimeIndicator(pygame.sprite.Sprite):
     """
     Class that defines the time indicator for the game. Identifies
-    how long the play has survived trough the game.
+    how long the play has survived trough the game. The time is
+    composed from the glyph atlas whenever the displayed text changes.
     """
 
     def __init__(self):
@@ -346,39 +988,206 @@ class TimeIndicator(pygame.sprite.Sprite):
         # Initialise the sprite
         super().__init__()
 
-        # Create the font for the current time
-        self.font = pygame.font.SysFont("Helvetica", 16)
-        self.color = (255, 255, 255)
-        # Create a dummy sprite outline
-        self.image = None
-        self.rect = pygame.Rect(0, 0, 0, 0)
-
+        # Retrieve the glyphs for the current time
+        self.atlas = GlyphAtlas.get("Helvetica", 16, (255, 255, 255))
         # Initially zero seconds have passed
-        self.time = 0
+        self.time = "00:00"
+        # Time that is currently displayed
+        self.displayed = self.time
+        self.image = self.atlas.render(self.time)
+        self.rect = self.image.get_rect()
 
     def update(self):
-        # Store old coordinates
-        x = self.rect.x
-        y = self.rect.y
+        # Re-render only the changed time
+        if self.time != self.displayed:
+            self.displayed = self.time
+            self.image = self.atlas.render(self.time)
+            self.rect.size = self.image.get_size()
+
+        # Base update routine
+        super().update()
 
-        # Re-render the changed time
-        label = self.font.render(self.time, 0, self.color)
-        self.image = label.convert_alpha()
+
+class ProfilerOverlay(pygame.sprite.Sprite):
+    """
+    Class that defines the HUD overlay showing the rolling frame
+    phase percentiles of the profiler. The table is re-rendered
+    only periodically to keep the overlay itself cheap.
+    """
+    # Number of the frames between the re-renders
+    INTERVAL = 30
+    # Characters of the phase names and the timings
+    CHARACTERS = GlyphAtlas.CHARACTERS + string.ascii_letters + "_()-"
+
+    def __init__(self, profiler):
+        """
+        Create a new profiler overlay.
+        :param profiler: Profiler to be displayed.
+        :return: Profiler overlay sprite.
+        """
+        # Initialise the sprite
+        super().__init__()
+
+        self.profiler = profiler
+        self.atlas = GlyphAtlas.get("Courier", 14, (255, 255, 0), characters=ProfilerOverlay.CHARACTERS)
+        # Frame that the table was last rendered at
+        self.rendered = None
+        self.render()
         self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
+
+    def render(self):
+        """
+        Render the table of the phase percentiles.
+        """
+        lines = ["%-22s %6s %6s %6s" % ("phase (ms)", "p50", "p95", "p99")]
+        for (phase, percentiles) in self.profiler.get_report():
+            lines.append("%-22s %6.2f %6.2f %6.2f" % tuple([phase] + percentiles))
+        labels = [self.atlas.render(x) for x in lines]
+        width = max(x.get_width() for x in labels) + 8
+        height = sum(x.get_height() for x in labels) + 8
+        self.image = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.image.fill((0, 0, 0, 160))
+        y = 4
+        for label in labels:
+            self.image.blit(label, (4, y))
+            y += label.get_height()
+        self.rendered = self.profiler.frames
+
+    def update(self):
+        # Re-render the table periodically
+        if self.profiler.frames - self.rendered >= ProfilerOverlay.INTERVAL:
+            self.render()
+            self.rect.size = self.image.get_size()
 
         # Base update routine
         super().update()
 
 
+class EndScreen:
+    """
+    Class that defines the end-game screen with the result of the
+    game, the retry hint and the high scores. The screen is composed
+    once into a cached surface, which is re-composed only when the
+    message or the high scores change.
+    """
+    # Hint displayed below the result of the game
+    HINT = "Press R to retry or M for multi-player :)"
+
+    def __init__(self, size, background):
+        """
+        Create a new end-game screen.
+        :param size: Size of the screen.
+        :param background: Colour of the background.
+        :return: End-game screen without anything composed yet.
+        """
+        self.size = size
+        self.background = background
+        # Font for the messages and glyphs for the scores
+        self.font = pygame.font.SysFont("Helvetica", 32)
+        self.atlas = GlyphAtlas.get("Helvetica", 32, (255, 255, 255), True)
+        # Message and scores that the cached surface shows
+        self.key = None
+        self.image = None
+
+    def blit_centered(self, label, offset):
+        """
+        Draw the label centred on the screen.
+        :param label: Surface with the label.
+        :param offset: Vertical offset from the centre of the screen.
+        """
+        x = (self.size[0] - label.get_width()) / 2
+        y = (self.size[1] - label.get_height()) / 2 + offset
+        self.image.blit(label, (x, y))
+
+    def render(self, message, scores):
+        """
+        Retrieve the end-game screen, composing it if needed.
+        :param message: Result of the game.
+        :param scores: High scores to be displayed (in the descending order).
+        :return: Surface with the end-game screen.
+        """
+        key = (message, tuple(scores))
+        if key == self.key:
+            return self.image
+
+        # Compose the screen from scratch
+        self.key = key
+        self.image = asset_cache.convert(pygame.Surface(self.size), False)
+        self.image.fill(self.background)
+        self.blit_centered(self.font.render(message, 1, (255, 255, 255)), -200)
+        self.blit_centered(self.font.render(EndScreen.HINT, 1, (255, 255, 255)), -100)
+        self.blit_centered(self.font.render("High scores:", 1, (255, 255, 255)), 0)
+        for (i, score) in enumerate(scores):
+            message = "%d. %02d:%02d" % (i + 1, (score // 60), (score % 60))
+            self.blit_centered(self.atlas.render(message), 50 * (i + 1))
+        return self.image
+
+
+class Camera:
+    """
+    Class that defines the viewport scrolling over the level.
+    Sprites are positioned in the world space, while the camera
+    maps them to the view space of the screen. Only the sprites
+    overlapping the viewport grown by a margin are visible.
+    """
+    # Distance beyond the viewport within which the sprites are still drawn
+    MARGIN = 64
+
+    def __init__(self, size, world_size, margin=MARGIN):
+        """
+        Create a new camera in the top left corner of the world.
+        :param size: Size of the viewport.
+        :param world_size: Size of the world.
+        :param margin: Distance beyond the viewport within which the sprites are still drawn.
+        :return: Camera instance.
+        """
+        self.rect = pygame.Rect((0, 0), size)
+        self.world = pygame.Rect((0, 0), world_size)
+        self.margin = margin
+        self.visible = self.rect.inflate(2 * margin, 2 * margin)
+
+    def follow(self, rect):
+        """
+        Centre the viewport on the rectangle without leaving the world.
+        :param rect: Rectangle in the world space.
+        """
+        self.rect.center = rect.center
+        self.rect.clamp_ip(self.world)
+        self.visible.center = self.rect.center
+
+    def get_offset(self):
+        """
+        Retrieve the position of the viewport in the world.
+        :return: Tuple of x and y.
+        """
+        return self.rect.topleft
+
+    def is_visible(self, rect):
+        """
+        Identify whether the rectangle is within the viewport and its margin.
+        :param rect: Rectangle in the world space.
+        :return: True if visible, false otherwise.
+        """
+        return self.visible.colliderect(rect)
+
+    def to_view(self, rect):
+        """
+        Map the rectangle from the world space to the view space.
+        :param rect: Rectangle in the world space.
+        :return: Rectangle in the view space.
+        """
+        return rect.move(-self.rect.x, -self.rect.y)
+
+
 class Level(pygame.sprite.LayeredUpdates):
     """
     Class that defines and manages a game level with all
     the environment objects, game characters and HUD elements
-    included.
+    included. Environment objects and characters are positioned in
+    the world, which may be wider than the screen, and are drawn
+    through the camera. HUD elements are positioned on the screen.
     """
-    # Layer ID for all the environment objects
+    # Layer ID for the dynamic environment objects (static ones are pre-baked)
     ENVIRONMENT = 0
     # Layer ID for the player and all the NPCs
     CHARACTERS = 1
@@ -386,11 +1195,25 @@ class Level(pygame.sprite.LayeredUpdates):
     HUD = 2
     # Vertical distance between platforms
     platform_spacing = 64
+    # Number of seconds after which another monster is added
+    MONSTER_INTERVAL = 20
 
-    def __init__(self, name, multiplayer = False):
+    def __init__(self, name, multiplayer = False, size=None, headless=False, clock=None, swarm=False, seed=None,
+                 view=None, streaming=False):
         """
-        Create a new level from the definition file.
+        Create a new level from the definition file. Headless levels
+        do not depend on the display: they have no HUD and no background.
+        Streamed levels build their environment in chunks around the
+        play area instead of up front, which suits the very wide levels.
         :param name: Name of the level.
+        :param multiplayer: Whether this is a multiplayer game.
+        :param size: Size of the world (defaults to the size of the display, or the level if streamed).
+        :param headless: Whether the level is simulated without a display.
+        :param clock: Simulation clock (a new one is started by default).
+        :param swarm: Whether the monsters are simulated as a NumPy swarm.
+        :param seed: Seed of the level randomness (picked at random by default).
+        :param view: Size of the viewport (defaults to the size of the display, or the world if headless).
+        :param streaming: Whether the environment is streamed in chunks.
         :return: Level sprite group.
         """
         # Initialise the sprite group
@@ -398,39 +1221,124 @@ class Level(pygame.sprite.LayeredUpdates):
 
         # Identify whether this is a multiplayer game
         self.multiplayer = multiplayer
-
-        # Identify the size of the screen
-        surface = pygame.display.get_surface()
-        width = surface.get_width()
-        height = surface.get_height()
+        self.headless = headless
+        # Clock that is advanced by a fixed step on every update
+        self.clock = clock if clock is not None else SimulationClock()
+        # Appearance and position of the sprites drawn by dirty-rect rendering
+        self.drawn = {}
+        # Monster swarm (None if the monsters are sprites)
+        self.swarm = None
+        # Profiler timing the phases of the update (None if not profiled)
+        self.profiler = None
+        # Randomness of the level is reproducible from its seed
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.random = random.Random(self.seed)
 
         # Read the level
         self.definition = LevelReader(name)
 
-        # Create the ground level
-        self.ground = GroundLevel(self.definition.ground_level)
-        self.add(self.ground, layer=Level.ENVIRONMENT)
+        # Identify the size of the screen
+        if size is None and streaming:
+            (width, height) = get_world_size()
+            columns = (Platform.slot_width - 2*Platform.border) * self.definition.columns + 2*Platform.border
+            size = (max(width, columns), height)
+        self.size = get_world_size(size)
+        (width, height) = self.size
+        # Camera scrolling over the world
+        if view is None:
+            view = self.size if headless else get_world_size()
+        self.camera = Camera(view, self.size)
+        # Camera position that the screen was last drawn from (None if never drawn)
+        self.drawn_offset = None
+
+        # Create the static environment used for the collisions
+        self.chunks = None
+        if streaming:
+            self.chunks = ChunkStreamer(self.definition, self.size, self.platform_spacing, headless)
+            self.collision_grid = self.chunks.grid
+            ground = self.chunks.ground_top
+        else:
+            self.environment = pygame.sprite.Group()
+            # Create the ground level
+            self.ground = GroundLevel(self.definition.ground_level, self.size)
+            self.environment.add(self.ground)
+            ground = self.ground.get_vertical_rect().top
         # Create the tower in the middle
-        self.tower = Tower()
-        self.tower.rect.bottom = self.ground.get_vertical_rect().top
+        self.tower = Tower(width)
+        self.tower.rect.bottom = ground
         # Create the player
-        self.player = Tin()
+        self.player = Tin(clock=self.clock)
         # Create the princess in the tower
         self.princess = LookerSprite(self.player, "Olivia", "StandingLeft")
         self.princess.rect.centerx = self.tower.rect.centerx - 5
         self.princess.rect.y = 168
-        self.add(self.princess, layer=Level.CHARACTERS)
-        self.add(self.tower, layer=Level.CHARACTERS)
-        self.add(self.player, layer=Level.CHARACTERS)
+        self.add_character(self.princess)
+        self.add_character(self.tower)
+        self.add_character(self.player)
 
         # Create the enemy
         if multiplayer:
             self.player.rect.x += 800
-            self.enemy = Tin(True)
-            self.add(self.enemy, layer=Level.CHARACTERS)
+            self.enemy = Tin(True, self.clock)
+            self.add_character(self.enemy)
             self.player.rect.bottom = self.enemy.rect.bottom = height
 
+        # Create the HUD unless nobody is going to see it
+        if not headless:
+            self.create_hud()
+
+        # Create the spawn locations on the ground and on every platform level but the top one
+        self.spawners = [ground - self.platform_spacing * x for x in range(len(self.definition.level))]
+
+        if not streaming:
+            # Create the platforms
+            y = ground
+            for line in self.definition.level:
+                y -= self.platform_spacing
+                for platform in line:
+                    (x, size, name) = platform
+                    platform = Platform(name, size)
+                    platform.rect.x = (Platform.slot_width - 2*Platform.border) * x + Platform.border
+                    platform.rect.y = y
+                    self.environment.add(platform)
+
+            # Index the static environment for the collisions
+            self.collision_grid = SpatialGrid(Platform.slot_width - 2*Platform.border, self.platform_spacing,
+                                              self.environment)
+
+        # Pre-bake the static environment into the level background (composed from the chunks if streamed)
+        self.background = None
+        # Position of the background in the world
+        self.background_origin = (0, 0)
+        if not headless and streaming:
+            self.background = pygame.Surface(self.camera.rect.size).convert()
+        elif not headless:
+            self.background = pygame.Surface((width, height)).convert()
+            self.background.fill(self.definition.background)
+            self.environment.draw(self.background)
+
         if not multiplayer:
+            # Create spawner manager and start spawning monsters
+            self.spawn_manager = SpawnerManager(self.spawners, width, self.random)
+            if swarm:
+                # NumPy is only required for the swarm
+                from tqot.swarm import MonsterSwarm
+                self.swarm = MonsterSwarm(self.tower, self.size, rng=self.random)
+                self.swarm.character_dead = self.replenish_monsters
+                self.monsters = self.swarm
+            else:
+                self.monsters = MonsterPool(self.tower, self.random)
+            self.create_monster()
+
+            # Time that is currently displayed by the indicator
+            self.time_displayed = None
+
+    def create_hud(self):
+        """
+        Create the HUD elements of the level.
+        """
+        (width, height) = self.camera.rect.size
+        if not self.multiplayer:
             # Create tower's health indicator in the top right corner
             self.tower_health = HealthIndicator(self.tower)
             self.tower_health.update()
@@ -456,7 +1364,7 @@ class Level(pygame.sprite.LayeredUpdates):
             self.add(self.player_icon, layer=Level.HUD)
 
         # Display the time icon in the top left corner
-        if not multiplayer:
+        if not self.multiplayer:
             self.time_icon = EnvironmentSprite("Time")
             self.time_icon.rect.left = 10
             self.time_icon.rect.top = 10
@@ -479,40 +1387,42 @@ class Level(pygame.sprite.LayeredUpdates):
             self.enemy_health.rect.left = self.enemy_icon.rect.right + 5
             self.add(self.enemy_health, layer=Level.HUD)
 
-        # Create the spawn locations
-        self.spawners = []
-
-        # Create the platforms
-        y = self.ground.get_vertical_rect().top
-        self.spawners.append(y)
-        for line in self.definition.level:
-            y -= self.platform_spacing
-            self.spawners.append(y)
-            for platform in line:
-                (x, size, name) = platform
-                platform = Platform(name, size)
-                platform.rect.x = (Platform.slot_width - 2*Platform.border) * x + Platform.border
-                platform.rect.y = y
-                self.add(platform, layer=Level.ENVIRONMENT)
-        # Make sure that monsters do not spawn above the top platform level
-        self.spawners.pop()
-
-        if not multiplayer:
-            # Create spawner manager and start spawning monsters
-            self.spawn_manager = SpawnerManager(self.spawners)
-            self.monsters = []
-            self.create_monster()
+    def add_character(self, sprite):
+        """
+        Add the character to the level and bind it to the level world.
+        :param sprite: Character sprite.
+        """
+        sprite.world_size = self.size
+        self.add(sprite, layer=Level.CHARACTERS)
 
-            # Record the time when the game has begun
-            self.start = time.time()
-            self.end = time.time()
+    def update(self, snapshot=None):
+        """
+        Advance the level by a single simulation step.
+        :param snapshot: Input snapshot of the frame (nothing is pressed by default).
+        """
+        # Advance the simulation by a single step
+        self.clock.tick()
+        # Let the controllers pick the actions of the characters
+        if snapshot is None:
+            snapshot = InputSnapshot()
+        self.player.control(snapshot)
+        if self.multiplayer:
+            self.enemy.control(snapshot)
+        # Recycle the monsters that died during the previous step
+        if not self.multiplayer and self.swarm is None:
+            self.monsters.collect()
+        # Stream in the environment around the characters (along with the platforms reaching over the chunks)
+        if self.chunks is not None:
+            characters = [self.player.rect, self.enemy.rect] if self.multiplayer else [self.player.rect]
+            self.chunks.require(characters, self.chunks.chunk_width)
 
-    def update(self):
         # Determine environment collisions
-        collision_list = pygame.sprite.spritecollide(self.player, self.get_sprites_from_layer(Level.ENVIRONMENT), False)
+        collision_list = self.collision_grid.collide(self.player)
         if len(collision_list) > 0:
             platform = collision_list[0]
             self.player.environment_collision(platform)
+        if self.profiler is not None:
+            self.profiler.lap("environment_collisions")
         # Determine character collisions
         collision_list = pygame.sprite.spritecollide(self.player, self.get_sprites_from_layer(Level.CHARACTERS), False)
         if len(collision_list) > 0:
@@ -520,9 +1430,11 @@ class Level(pygame.sprite.LayeredUpdates):
                 # Can't hurt yourself or your tower
                 if character != self.player and character != self.tower:
                     self.player.character_collision(character)
+        if self.swarm is not None:
+            self.swarm.character_collision(self.player)
         if self.multiplayer:
             # Determine environment collisions
-            collision_list = pygame.sprite.spritecollide(self.enemy, self.get_sprites_from_layer(Level.ENVIRONMENT), False)
+            collision_list = self.collision_grid.collide(self.enemy)
             if len(collision_list) > 0:
                 platform = collision_list[0]
                 self.enemy.environment_collision(platform)
@@ -533,14 +1445,185 @@ class Level(pygame.sprite.LayeredUpdates):
                     # Can't hurt yourself or your tower
                     if character != self.enemy and character != self.tower:
                         self.enemy.character_collision(character)
+        if self.profiler is not None:
+            self.profiler.lap("character_collisions")
 
         if not self.multiplayer:
-            # Update the game time and its indicator
-            self.end = time.time()
-            self.time_indicator.time = self.get_pretty_time()
+            # Update the game time indicator once a second
+            if not self.headless and self.get_time() != self.time_displayed:
+                self.time_displayed = self.get_time()
+                self.time_indicator.time = self.get_pretty_time()
 
         # Base update routine
-        super().update()
+        if self.swarm is None:
+            super().update()
+        else:
+            # Update the swarm after the characters, but before the HUD
+            swarm_updated = False
+            for sprite in self.sprites():
+                if not swarm_updated and self.get_layer_of_sprite(sprite) == Level.HUD:
+                    self.swarm.update()
+                    swarm_updated = True
+                sprite.update()
+            if not swarm_updated:
+                self.swarm.update()
+        if self.profiler is not None:
+            self.profiler.lap("sprite_updates")
+
+    def scroll(self):
+        """
+        Move the camera to follow the characters.
+        :return: True if the screen needs to be redrawn from a new position, false otherwise.
+        """
+        if self.multiplayer:
+            self.camera.follow(self.player.rect.union(self.enemy.rect))
+        else:
+            self.camera.follow(self.player.rect)
+        offset = self.camera.get_offset()
+        scrolled = offset != self.drawn_offset
+        self.drawn_offset = offset
+        # Streamed background only covers the view
+        if scrolled and self.chunks is not None and self.background is not None:
+            self.chunks.compose(self.background, offset)
+            self.background_origin = offset
+        return scrolled
+
+    def get_background_offset(self):
+        """
+        Identify where the screen is located on the level background.
+        :return: Tuple of x and y.
+        """
+        (x, y) = self.camera.get_offset()
+        (origin_x, origin_y) = self.background_origin
+        return (x - origin_x, y - origin_y)
+
+    def get_view_rect(self, sprite):
+        """
+        Identify where the sprite is drawn on the screen.
+        :param sprite: Sprite of the level.
+        :return: Rectangle in the view space (None if the sprite is not visible).
+        """
+        if self.get_layer_of_sprite(sprite) == Level.HUD:
+            return sprite.rect
+        if not self.camera.is_visible(sprite.rect):
+            return None
+        return self.camera.to_view(sprite.rect)
+
+    def clear(self, surface, background):
+        # Erase the sprites and the monster swarm where they were last drawn
+        offset = self.get_background_offset()
+        for rect in self.lostsprites:
+            surface.blit(background, rect, rect.move(offset))
+        for rect in self.spritedict.values():
+            if rect is not self._init_rect:
+                surface.blit(background, rect, rect.move(offset))
+        if self.swarm is not None:
+            self.swarm.clear(surface, background, offset)
+
+    def draw(self, surface):
+        dirty = self.lostsprites
+        self.lostsprites = []
+        # Whole view of the background is shown once the camera has moved
+        if self.scroll() and self.background is not None:
+            dirty.append(surface.blit(self.background, (0, 0), surface.get_rect().move(self.get_background_offset())))
+
+        # Draw the visible sprites layer by layer with the swarm right below the HUD
+        swarm_drawn = self.swarm is None
+        for sprite in self.sprites():
+            if not swarm_drawn and self.get_layer_of_sprite(sprite) == Level.HUD:
+                dirty.extend(self.swarm.draw(surface, self.camera.get_offset(), self.camera.visible))
+                swarm_drawn = True
+            previous = self.spritedict[sprite]
+            if previous is not self._init_rect:
+                dirty.append(previous)
+            rect = self.get_view_rect(sprite)
+            if rect is None:
+                self.spritedict[sprite] = self._init_rect
+                continue
+            rect = surface.blit(sprite.image, rect)
+            dirty.append(rect)
+            self.spritedict[sprite] = rect
+        if not swarm_drawn:
+            dirty.extend(self.swarm.draw(surface, self.camera.get_offset(), self.camera.visible))
+        return dirty
+
+    def draw_dirty(self, surface, background):
+        """
+        Draw only the parts of the level that have changed since the
+        previous call. A sprite is considered changed when it has moved
+        or its image was swapped, since the shared art assets are never
+        modified in place. The whole screen is redrawn once the camera
+        has moved.
+        :param surface: Surface to draw the level on.
+        :param background: Background to restore the changed areas with.
+        :return: List of the changed rectangles on the surface.
+        """
+        bounds = surface.get_rect()
+        scrolled = self.scroll()
+        offset = self.camera.get_offset()
+        drawn = {}
+        visible = []
+        dirty = []
+        # Identify the areas that were changed by the visible sprites
+        for sprite in self.sprites():
+            rect = self.get_view_rect(sprite)
+            previous = self.drawn.pop(sprite, None)
+            if rect is None:
+                if previous is not None:
+                    dirty.append(bounds.clip(previous[1]))
+                continue
+            state = (sprite.image, tuple(rect))
+            if previous != state:
+                if previous is not None:
+                    dirty.append(bounds.clip(previous[1]))
+                dirty.append(bounds.clip(rect))
+            drawn[sprite] = state
+            visible.append((sprite, rect))
+        # Sprites that were removed leave their areas behind
+        for (image, rect) in self.drawn.values():
+            dirty.append(bounds.clip(rect))
+        self.drawn = drawn
+        # Monsters of the swarm are always redrawn
+        if self.swarm is not None:
+            rects = self.swarm.get_rects(offset, self.camera.visible)
+            dirty.extend(bounds.clip(rect) for rect in self.swarm.drawn + rects)
+        dirty = [bounds] if scrolled else self.merge_rects(dirty)
+
+        # Restore the background in the changed areas
+        origin = self.get_background_offset()
+        for rect in dirty:
+            surface.blit(background, rect, rect.move(origin))
+        # Redraw the sprites overlapping the changed areas layer by layer
+        swarm_drawn = self.swarm is None
+        for (sprite, rect) in visible:
+            if not swarm_drawn and self.get_layer_of_sprite(sprite) == Level.HUD:
+                self.swarm.draw(surface, offset, self.camera.visible)
+                swarm_drawn = True
+            for index in rect.collidelistall(dirty):
+                area = rect.clip(dirty[index])
+                surface.blit(sprite.image, area, area.move(-rect.x, -rect.y))
+        if not swarm_drawn:
+            self.swarm.draw(surface, offset, self.camera.visible)
+        return dirty
+
+    @staticmethod
+    def merge_rects(rects):
+        """
+        Merge the overlapping rectangles, so that no area is drawn twice.
+        :param rects: List of rectangles.
+        :return: List of non-overlapping rectangles covering the same areas.
+        """
+        merged = []
+        for rect in rects:
+            if rect.width == 0 or rect.height == 0:
+                continue
+            # Absorb all the rectangles that overlap the new one
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
 
     def character_dead(self, sprite):
         """
@@ -551,6 +1634,12 @@ class Level(pygame.sprite.LayeredUpdates):
         self.remove(sprite)
         self.monsters.remove(sprite)
         # Create new monsters instead
+        self.replenish_monsters()
+
+    def replenish_monsters(self):
+        """
+        Create new monsters until there are as many as required.
+        """
         while len(self.monsters) < self.get_monsters_count():
             self.create_monster()
 
@@ -558,21 +1647,24 @@ class Level(pygame.sprite.LayeredUpdates):
         """
         Create a new monster at chosen random spawn position.
         """
-        # Create a monster
-        monster = MonsterAimer(self.tower)
+        # Spawn the monster as a part of the swarm
+        if self.swarm is not None:
+            self.swarm.spawn(self.spawn_manager)
+            return
+        # Create a monster (or recycle a dead one)
+        monster = self.monsters.acquire()
         monster.character_dead = self.character_dead
         # Position the monster
         self.spawn_manager.set_location(monster)
         # Display the monster
-        self.monsters.append(monster)
-        self.add(monster, layer=Level.CHARACTERS)
+        self.add_character(monster)
 
     def get_time(self):
         """
         How long the player lasted on this level.
         :return: Total time played in seconds.
         """
-        return int(self.end - self.start)
+        return int(self.clock.get_ticks() // 1000)
 
     def get_pretty_time(self):
         """
@@ -593,7 +1685,7 @@ class Level(pygame.sprite.LayeredUpdates):
         on top.
         :return: Number of monsters.
         """
-        return self.get_time() // 20 + 1
+        return self.get_time() // Level.MONSTER_INTERVAL + 1
 
     def is_over(self):
         """
@@ -602,4 +1694,11 @@ class Level(pygame.sprite.LayeredUpdates):
         """
         if self.multiplayer:
             return self.enemy.is_dead() or self.player.is_dead()
-        return self.tower.is_dead()
\ No newline at end of file
+        return self.tower.is_dead()
+
+    def close(self):
+        """
+        Release the background resources of the level once it is no longer played.
+        """
+        if self.chunks is not None:
+            self.chunks.close()
\ No newline at end of file
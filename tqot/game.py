@@ -1,7 +1,29 @@
+import argparse
+import time
 import pygame
 import pygame.font
 import pygame.sprite
-from tqot.environment import *
+from tqot.replay import *
+
+# Parse the command line options
+parser = argparse.ArgumentParser(description="The Quest of Tin")
+parser.add_argument("--dirty", action="store_true",
+                    help="redraw only the changed parts of the screen")
+parser.add_argument("--swarm", action="store_true",
+                    help="simulate the monsters as a NumPy swarm")
+parser.add_argument("--no-atlas", dest="atlas", action="store_false",
+                    help="load the art assets as separate surfaces")
+parser.add_argument("--timings", action="store_true",
+                    help="report how long the art assets took to load")
+parser.add_argument("--profile", metavar="CSV",
+                    help="dump the frame phase timings to the CSV file on exit (F3 shows them)")
+parser.add_argument("--record", metavar="FILE",
+                    help="record the latest game to the file for a headless replay")
+parser.add_argument("--world-width", type=int,
+                    help="width of the world scrolled by the camera (the width of the screen by default)")
+parser.add_argument("--stream", action="store_true",
+                    help="build the level in chunks around the play area (for the levels wider than the screen)")
+args = parser.parse_args()
 
 # Initialise the pygame software and hardware layers
 pygame.init()
@@ -11,85 +33,163 @@ size = (1000, 480)
 screen = pygame.display.set_mode(size)
 pygame.display.set_caption("The Quest of Tin")
 
-# Create the game level
-level = Level("SkyLand")
 
-# Create the font to be used for
-font = pygame.font.SysFont("Helvetica", 32)
+def show_progress(done, total):
+    """
+    Display the progress of loading the art assets.
+    :param done: Number of the loaded assets.
+    :param total: Total number of the assets.
+    """
+    bar = pygame.Rect(0, 0, size[0] // 2, 8)
+    bar.center = (size[0] // 2, size[1] // 2)
+    screen.fill((0, 0, 0))
+    pygame.draw.rect(screen, (255, 255, 255), bar, 1)
+    bar.width = bar.width * done // max(total, 1)
+    pygame.draw.rect(screen, (255, 255, 255), bar)
+    pygame.display.flip()
+    pygame.event.pump()
+
+
+# Pack the art assets into a texture atlas and load them all up front
+start = time.perf_counter()
+if args.atlas:
+    asset_cache.use_atlas(TextureAtlas.create())
+atlas_time = time.perf_counter() - start
+report = asset_cache.preload(progress=show_progress)
+if args.timings:
+    print("Loaded %d assets in %.1f ms (atlas %.1f ms, decode %.1f ms, convert %.1f ms)" %
+          (report["assets"], (atlas_time + report["total"]) * 1000, atlas_time * 1000,
+           report["decode"] * 1000, report["convert"] * 1000))
+
+# Profile the phases of every frame (F3 toggles the overlay)
+profiler = FrameProfiler()
+overlay = ProfilerOverlay(profiler)
+overlay.rect.topleft = (10, 40)
+show_overlay = False
+# Recording of the current game (if recording)
+replay = None
+
+
+def start_level(multiplayer=False):
+    """
+    Create a new game level and paint its background on the display.
+    :param multiplayer: Whether this is a multiplayer game.
+    :return: Game level.
+    """
+    global replay
+    world = (args.world_width, size[1]) if args.world_width else None
+    level = Level("SkyLand", multiplayer, world, swarm=args.swarm, streaming=args.stream)
+    level.profiler = profiler
+    if args.record:
+        replay = Replay.record(level)
+    # Move the overlay over from the previous level
+    overlay.kill()
+    if show_overlay:
+        level.add(overlay, layer=Level.HUD)
+    screen.blit(level.background, (0, 0), level.camera.rect)
+    return level
 
-# Paint temporary background on the display
-background = pygame.Surface(size).convert()
-background.fill(level.definition.background)
-screen.blit(background, (0, 0))
 
-# Load the scores
-scores = load_scores()
+# Create the game level
+level = start_level()
+
+# Create the end-game screen on the plain level background
+end_screen = EndScreen(size, level.definition.background)
+# Level and end-game screen that are currently displayed
+displayed_end = None
+
+# Open the score store
+scores = ScoreStore()
+# Level whose end has been recorded
+recorded_level = None
 
 # Start the game loop with the maximum of 60 frames/sec
 running = True
 fps = 60
 clock = pygame.time.Clock()
+# Whole screen needs to be displayed until the dirty-rect rendering kicks in
+redraw = True
+# Real time that the simulation lags behind (capped to avoid a catch-up spiral)
+lag = 0
+max_lag = 5 * SimulationClock.STEP
 while running:
-    clock.tick(fps)
+    lag = min(lag + clock.tick(fps), max_lag)
+    profiler.start_frame()
+    # Areas of the screen that have changed (None for the whole screen)
+    changed = None
     # Exit if requested
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
+        # Toggle the profiler overlay
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            show_overlay = not show_overlay
+            if show_overlay:
+                level.add(overlay, layer=Level.HUD)
+            else:
+                level.remove(overlay)
+    # Take a single snapshot of the input for the whole frame
+    snapshot = InputSnapshot.capture()
+    profiler.lap("input")
     # Update in-game objects or draw the end-game screen
     if not level.is_over():
-        level.clear(screen, background)
-        level.update()
-        level.draw(screen)
+        if not args.dirty:
+            level.clear(screen, level.background)
+            profiler.lap("clear")
+        # Advance the simulation in fixed steps independently of the rendering
+        while lag >= level.clock.step and not level.is_over():
+            level.update(snapshot)
+            lag -= level.clock.step
+        if args.dirty:
+            changed = level.draw_dirty(screen, level.background)
+        else:
+            level.draw(screen)
+        profiler.lap("draw")
     else:
-        # Store the high score
-        if not level.multiplayer and (len(scores) == 0 or not level.get_time() in scores):
-            scores.append(level.get_time())
-            scores = list(reversed(sorted(scores)))
-            save_scores(scores)
+        # Store the high score and the recording once per game
+        if recorded_level is not level:
+            if not level.multiplayer:
+                scores.add(level.get_time())
+            if replay is not None:
+                replay.finish(level)
+                replay.save(args.record)
+            recorded_level = level
 
         if not level.multiplayer:
-            # Display end-game message
-            screen.blit(background, (0, 0))
             message = "The tower has fallen! Your score is " + level.get_pretty_time() + "!"
-            label = font.render(message, 1, (255, 255, 255))
-            x = (size[0] - label.get_width()) / 2
-            y = (size[1] - label.get_height()) / 2 - 200
-            screen.blit(label, (x, y))
         else:
-            # Display end-game message
-            screen.blit(background, (0, 0))
             message = "Sin has won! The darkness grows!" if level.player.is_dead()\
                                                         else "Tin has won! Nothing escapes the light!"
-            label = font.render(message, 1, (255, 255, 255))
-            x = (size[0] - label.get_width()) / 2
-            y = (size[1] - label.get_height()) / 2 - 200
-            screen.blit(label, (x, y))
-        # Display progress message
-        message = "Press R to retry or M for multi-player :)"
-        label = font.render(message, 1, (255, 255, 255))
-        x = (size[0] - label.get_width()) / 2
-        y = (size[1] - label.get_height()) / 2 - 100
-        screen.blit(label, (x, y))
-        # Display the high scores
-        message = "High scores:"
-        label = font.render(message, 1, (255, 255, 255))
-        x = (size[0] - label.get_width()) / 2
-        y = (size[1] - label.get_height()) / 2
-        screen.blit(label, (x, y))
-        for i in range(0, min(3, len(scores))):
-            message = "%d. %02d:%02d" % (i + 1,  (scores[i] // 60), (scores[i] % 60))
-            label = font.render(message, 1, (255, 255, 255))
-            x = (size[0] - label.get_width()) / 2
-            y = (size[1] - label.get_height()) / 2 + 50 * (i + 1)
-            screen.blit(label, (x, y))
+        # Display the end-game screen only when it changes
+        image = end_screen.render(message, scores.get_top(3))
+        if displayed_end != (level, image):
+            screen.blit(image, (0, 0))
+            displayed_end = (level, image)
+        else:
+            changed = []
 
         # Restart the level once finished
-        pressed_keys = pygame.key.get_pressed()
-        if pressed_keys[pygame.K_r]:
-            screen.blit(background, (0, 0))
-            level = Level("SkyLand")
-        if pressed_keys[pygame.K_m]:
-            screen.blit(background, (0, 0))
-            level = Level("SkyLand", True)
+        if snapshot.is_pressed(pygame.K_r) or snapshot.is_pressed(pygame.K_m):
+            level.close()
+            level = start_level(snapshot.is_pressed(pygame.K_m))
+            # Present the whole new level over the end-game screen
+            redraw = True
+        profiler.lap("end_screen")
 
-    pygame.display.flip()
+    # Display the changes
+    if changed is None or redraw:
+        pygame.display.flip()
+        redraw = changed is None
+    else:
+        pygame.display.update(changed)
+    profiler.lap("flip")
+    profiler.end_frame()
+
+# Store the recording of the unfinished game
+if replay is not None and recorded_level is not level:
+    replay.finish(level)
+    replay.save(args.record)
+level.close()
+# Store the frame phase timings
+if args.profile:
+    profiler.dump(args.profile)
@@ -1,29 +1,74 @@
+import heapq
 import json
+import os
 import pygame.display
 import random
+import zlib
+
+
+def get_world_size(size=None):
+    """
+    Identify the size of the game world. Headless games pass
+    the size explicitly, otherwise it matches the display.
+    :param size: Explicit size of the world (if any).
+    :return: Tuple of width and height.
+    """
+    if size is not None:
+        return size
+    return pygame.display.get_surface().get_size()
 
 
 class Damageable:
     """
     Class that defines a logic for damageable and,
-    as a result, kill-able creature.
+    as a result, kill-able creature. Tracks a version
+    counter of the health changes, so that observers only
+    need to compare it instead of the health values.
     """
+    # Number of times the health of the creature has changed
+    health_version = 0
+    # Health values for the creatures that were never initialised
+    _current = 0
+    maximum = 0
+
     def __init__(self):
         """
         Create a new damageable creature.
         :return: Damageable creature.
         """
-        self.current = 0
+        self._current = 0
         self.maximum = 0
 
+    @property
+    def current(self):
+        """
+        Current creature health.
+        """
+        return self._current
+
+    @current.setter
+    def current(self, value):
+        # Only actual changes are published
+        if value == self._current:
+            return
+        self._current = value
+        self.health_changed()
+
     def set_health(self, current, maximum):
         """
         Set the new values for the creature health.
         :param current: Current creature health.
         :param maximum: Maximum creature health.
         """
-        self.current = current
+        self._current = current
         self.maximum = maximum
+        self.health_changed()
+
+    def health_changed(self):
+        """
+        Bump the health version.
+        """
+        self.health_version += 1
 
     def character_attacked(self):
         """
@@ -40,13 +85,15 @@ class SpawnerManager:
     Class that defines the spawner manager and
     is able to position the sprites for the game.
     """
-    def __init__(self, heights):
+    def __init__(self, heights, width=None, rng=None):
         # Identify and save the size of the screen
-        surface = pygame.display.get_surface()
-        width = surface.get_width()
+        if width is None:
+            (width, height) = get_world_size()
         self.screen_width = width
         # Store the heights at which the monsters can be spawned
         self.heights = heights
+        # Random number generator to position the sprites with
+        self.random = rng if rng is not None else random
 
     def set_location(self, sprite):
         """
@@ -54,30 +101,180 @@ class SpawnerManager:
         :param sprite: Sprite position.
         """
         # Identify y coordinate
-        sprite.rect.y = random.choice(self.heights)
-        x = random.getrandbits(1) or self.screen_width
+        sprite.rect.y = self.random.choice(self.heights)
+        x = self.random.getrandbits(1) or self.screen_width
         if x > 1:
             sprite.rect.left = x
         else:
             sprite.rect.right = x
 
 
-def load_scores():
+class ScoreStore:
     """
-    Load the high scores from the file.
-    :return: High scores.
+    Class that defines a crash-safe store of the high scores.
+    Every score is appended to a log as a checksummed record, so
+    a torn write only loses the record being written. Only the
+    best scores are kept in memory (in a bounded min-heap) and
+    the log is periodically compacted down to them, replacing
+    the file atomically. The store is located beside the game
+    rather than in the current working directory.
     """
-    try:
-        with open("scores.json", "r") as file:
-            return json.load(file)
-    except:
-        return []
+    # Default location of the log
+    PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scores.log")
+    # Scores stored by the previous versions of the game
+    LEGACY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scores.json")
+    # Number of the best scores that are kept
+    CAPACITY = 100
+    # Number of the records appended before the log is compacted
+    COMPACT_THRESHOLD = 1000
 
+    def __init__(self, path=PATH, capacity=CAPACITY, compact_threshold=COMPACT_THRESHOLD):
+        """
+        Open the score store and load the scores from the log.
+        :param path: Path to the log.
+        :param capacity: Number of the best scores that are kept.
+        :param compact_threshold: Number of the records appended before the log is compacted.
+        :return: Score store.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.compact_threshold = compact_threshold
+        # Min-heap of the best scores
+        self.heap = []
+        # Best scores in the descending order (None if not sorted yet)
+        self.top = None
+        # Number of the records in the log
+        self.records = 0
+        # Number of the corrupted records found while loading
+        self.corrupted = 0
+        self.load()
 
-def save_scores(scores):
-    """
-    Save the high scores to the file.
-    :param scores: Maximum scores.
-    """
-    with open("scores.json", "w") as file:
-        json.dump(scores, file)
\ No newline at end of file
+    @staticmethod
+    def encode(score):
+        """
+        Encode the score as a log record.
+        :param score: Score to be encoded.
+        :return: Record as a string.
+        """
+        value = str(int(score))
+        return "%s %08x\n" % (value, zlib.crc32(value.encode()))
+
+    @staticmethod
+    def decode(record):
+        """
+        Decode the log record.
+        :param record: Record as a string.
+        :return: Score or None if the record is corrupted.
+        """
+        parts = record.split(" ")
+        if not record.endswith("\n") or len(parts) != 2:
+            return None
+        (value, checksum) = parts
+        try:
+            if int(checksum, 16) != zlib.crc32(value.encode()):
+                return None
+            return int(value)
+        except ValueError:
+            return None
+
+    def push(self, score):
+        """
+        Offer the score to the in-memory top scores. Every score is kept once.
+        :param score: Score to be offered.
+        """
+        if score in self.heap:
+            return
+        if len(self.heap) < self.capacity:
+            heapq.heappush(self.heap, score)
+        elif score > self.heap[0]:
+            heapq.heapreplace(self.heap, score)
+        else:
+            return
+        self.top = None
+
+    def load(self):
+        """
+        Load the scores from the log. Corrupted records are skipped and
+        the log is compacted to get rid of them.
+        """
+        self.heap = []
+        self.top = None
+        self.records = 0
+        self.corrupted = 0
+        try:
+            with open(self.path, "r") as file:
+                for record in file:
+                    score = self.decode(record)
+                    if score is None:
+                        self.corrupted += 1
+                        continue
+                    self.records += 1
+                    self.push(score)
+        except FileNotFoundError:
+            # Start with the scores of the previous versions of the game
+            if self.path == ScoreStore.PATH and os.path.exists(ScoreStore.LEGACY_PATH):
+                self.load_legacy(ScoreStore.LEGACY_PATH)
+                self.compact()
+            return
+        if self.corrupted > 0 or self.records > self.compact_threshold:
+            self.compact()
+
+    def load_legacy(self, path):
+        """
+        Load the scores stored by the previous versions of the game.
+        A corrupted file or entry is counted and skipped.
+        :param path: Path to the legacy scores.
+        """
+        try:
+            with open(path, "r") as file:
+                scores = json.load(file)
+        except (OSError, ValueError):
+            self.corrupted += 1
+            return
+        if not isinstance(scores, list):
+            self.corrupted += 1
+            return
+        for score in scores:
+            try:
+                self.push(int(score))
+            except (TypeError, ValueError, OverflowError):
+                self.corrupted += 1
+
+    def add(self, score):
+        """
+        Record the score of a finished game, unless it is already among the best ones.
+        :param score: Score to be recorded.
+        """
+        if int(score) in self.heap:
+            return
+        with open(self.path, "a") as file:
+            file.write(self.encode(score))
+            file.flush()
+            os.fsync(file.fileno())
+        self.records += 1
+        self.push(int(score))
+        if self.records > self.compact_threshold:
+            self.compact()
+
+    def get_top(self, count=3):
+        """
+        Retrieve the best scores.
+        :param count: Number of the scores.
+        :return: List of the scores in the descending order.
+        """
+        if self.top is None:
+            self.top = sorted(self.heap, reverse=True)
+        return self.top[:count]
+
+    def compact(self):
+        """
+        Rewrite the log with only the best scores. The new log replaces
+        the old one atomically, so a crash leaves either of them intact.
+        """
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            file.writelines(self.encode(x) for x in self.get_top(self.capacity))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+        self.records = len(self.heap)
@@ -0,0 +1,529 @@
+import argparse
+import asyncio
+import collections
+import os
+import struct
+import time
+from tqot.simulation import *
+
+
+class StateCodec:
+    """
+    Class that defines the binary encoding of the game state sent
+    by the server. Only the fields of the characters that changed
+    since the previous frame sent to the client are encoded: each
+    changed character is identified by its index and a bit mask of
+    the fields that follow. Messages are length-prefixed.
+    """
+    # Message prefix with the length of the message
+    LENGTH = struct.Struct("<H")
+    # Message types
+    INPUT = 1
+    WELCOME = 2
+    STATE = 3
+    # Input of the client: type, sequence number and actions
+    INPUT_MESSAGE = struct.Struct("<BIB")
+    # Welcome of the client: type, player index, seed and world size (followed by the level name)
+    WELCOME_MESSAGE = struct.Struct("<BBQHH")
+    # State header: type, frame and sequence number of the last input applied
+    STATE_MESSAGE = struct.Struct("<BII")
+    # Changed character: index and mask of the changed fields
+    CHARACTER = struct.Struct("<BB")
+    # Character fields: position, jump counter, state and health
+    FIELDS = [struct.Struct(x) for x in ("<h", "<h", "<B", "<B", "<f")]
+    # Number of the fields describing the movement (the state is only cosmetic and the health is not predicted)
+    MOVEMENT = 3
+    # States of the characters in the order of their indices
+    STATES = ("StandingRight", "StandingLeft", "MovingRight", "MovingRight2", "MovingLeft", "MovingLeft2",
+              "AttackRight", "AttackLeft")
+
+    @staticmethod
+    def capture(character):
+        """
+        Capture the fields of the character.
+        :param character: Character sprite.
+        :return: Tuple of the fields.
+        """
+        # Health is sent with the precision it is encoded with
+        (health,) = StateCodec.FIELDS[4].unpack(StateCodec.FIELDS[4].pack(character.current))
+        return (character.rect.x, character.rect.y, character.jump, StateCodec.STATES.index(character.get_state()),
+                health)
+
+    @staticmethod
+    def apply(character, fields, movement=True, appearance=True):
+        """
+        Apply the fields to the character.
+        :param character: Character sprite.
+        :param fields: Tuple of the fields.
+        :param movement: Whether the movement is applied.
+        :param appearance: Whether the state is applied.
+        """
+        if movement:
+            (character.rect.x, character.rect.y, character.jump) = fields[:StateCodec.MOVEMENT]
+        if appearance:
+            character.set_state(StateCodec.STATES[fields[3]])
+        character.current = fields[4]
+
+    @staticmethod
+    def pack(payload):
+        """
+        Prefix the message with its length.
+        :param payload: Message as bytes.
+        :return: Framed message.
+        """
+        return StateCodec.LENGTH.pack(len(payload)) + payload
+
+    @staticmethod
+    async def read(reader):
+        """
+        Read a single message.
+        :param reader: Stream to read from.
+        :return: Message as bytes.
+        """
+        (length,) = StateCodec.LENGTH.unpack(await reader.readexactly(StateCodec.LENGTH.size))
+        return await reader.readexactly(length)
+
+    @staticmethod
+    def encode(frame, ack, previous, current):
+        """
+        Encode the changes of the characters.
+        :param frame: Frame of the state.
+        :param ack: Sequence number of the last input of the client applied.
+        :param previous: Fields of the characters sent before (None if nothing was sent).
+        :param current: Current fields of the characters.
+        :return: State message as bytes.
+        """
+        message = bytearray(StateCodec.STATE_MESSAGE.pack(StateCodec.STATE, frame, ack))
+        for (index, fields) in enumerate(current):
+            before = previous[index] if previous is not None else None
+            mask = 0
+            for field in range(len(fields)):
+                if before is None or before[field] != fields[field]:
+                    mask |= 1 << field
+            if mask == 0:
+                continue
+            message += StateCodec.CHARACTER.pack(index, mask)
+            for field in range(len(fields)):
+                if mask & 1 << field:
+                    message += StateCodec.FIELDS[field].pack(fields[field])
+        return bytes(message)
+
+    @staticmethod
+    def decode(message, states):
+        """
+        Decode the state message and apply the changes.
+        :param message: State message as bytes.
+        :param states: Fields of the characters to be updated.
+        :return: Tuple of the frame and the sequence number of the last input applied.
+        """
+        (kind, frame, ack) = StateCodec.STATE_MESSAGE.unpack_from(message, 0)
+        offset = StateCodec.STATE_MESSAGE.size
+        while offset < len(message):
+            (index, mask) = StateCodec.CHARACTER.unpack_from(message, offset)
+            offset += StateCodec.CHARACTER.size
+            fields = list(states[index]) if states[index] is not None else [0] * len(StateCodec.FIELDS)
+            for (field, codec) in enumerate(StateCodec.FIELDS):
+                if mask & 1 << field:
+                    (fields[field],) = codec.unpack_from(message, offset)
+                    offset += codec.size
+            states[index] = tuple(fields)
+        return (frame, ack)
+
+
+class RemotePlayer:
+    """
+    Class that defines a client connected to the server.
+    """
+
+    def __init__(self, index, writer):
+        """
+        Create a new connected client.
+        :param index: Index of the character controlled by the client.
+        :param writer: Stream to send the messages with.
+        :return: Connected client.
+        """
+        self.index = index
+        self.writer = writer
+        # Inputs that were not applied yet (one is applied per step)
+        self.inputs = collections.deque()
+        # Sequence number of the last input applied
+        self.ack = 0
+        # Fields of the characters that were last sent
+        self.baseline = None
+        self.connected = True
+
+
+class GameServer:
+    """
+    Class that defines the server running the authoritative
+    multiplayer level. Every connected client controls one of
+    the characters: its inputs are applied one per simulation
+    step and the changes of the characters are sent back after
+    every step. The character of a disconnected client is taken
+    over by the next client that joins.
+    """
+    # Maximum number of the inputs queued by a client
+    MAX_INPUTS = 30
+
+    def __init__(self, name="SkyLand", size=(1000, 480), players=2, rate=60, seed=None):
+        """
+        Create a new server with the level.
+        :param name: Name of the level.
+        :param size: Size of the world.
+        :param players: Number of the players to wait for before starting.
+        :param rate: Simulation steps per second.
+        :param seed: Seed of the level randomness (picked at random by default).
+        :return: Server that is not listening yet.
+        """
+        asset_cache.configure(convert=False, decode=False)
+        self.name = name
+        self.players = players
+        self.rate = rate
+        self.level = Level(name, True, size, headless=True, seed=seed)
+        self.characters = [self.level.player, self.level.enemy]
+        self.controllers = [ActionController(), ActionController()]
+        for (character, controller) in zip(self.characters, self.controllers):
+            character.controller = controller
+        self.clients = []
+        self.server = None
+        self.port = None
+        self.joined = None
+        # Server statistics
+        self.frames = 0
+        self.bytes_sent = 0
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Start listening for the clients.
+        :param host: Address to listen on.
+        :param port: Port to listen on (an ephemeral one by default).
+        """
+        self.joined = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        """
+        Serve the connected client.
+        :param reader: Stream to receive the messages with.
+        :param writer: Stream to send the messages with.
+        """
+        # Rejoining clients take over the character of a disconnected one
+        free = [x.index for x in self.clients if not x.connected]
+        if len(free) > 0:
+            client = RemotePlayer(free[0], writer)
+            self.clients[client.index] = client
+        elif len(self.clients) < len(self.characters):
+            client = RemotePlayer(len(self.clients), writer)
+            self.clients.append(client)
+        else:
+            writer.close()
+            return
+        (width, height) = self.level.size
+        welcome = StateCodec.WELCOME_MESSAGE.pack(StateCodec.WELCOME, client.index, self.level.seed, width, height)
+        writer.write(StateCodec.pack(welcome + self.name.encode("utf-8")))
+        if len(self.clients) >= self.players:
+            self.joined.set()
+        try:
+            while True:
+                message = await StateCodec.read(reader)
+                if message[0] == StateCodec.INPUT:
+                    (kind, sequence, actions) = StateCodec.INPUT_MESSAGE.unpack(message)
+                    client.inputs.append((sequence, actions))
+                    # Drop the oldest inputs of a client running ahead
+                    while len(client.inputs) > GameServer.MAX_INPUTS:
+                        client.inputs.popleft()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        # Disconnected characters stop acting
+        client.connected = False
+        self.controllers[client.index].actions = 0
+        writer.close()
+
+    def tick(self):
+        """
+        Apply the inputs, advance the level by a single step and send the changes.
+        """
+        for client in self.clients:
+            if len(client.inputs) > 0:
+                (client.ack, self.controllers[client.index].actions) = client.inputs.popleft()
+        self.level.update()
+        self.frames += 1
+        current = [StateCodec.capture(x) for x in self.characters]
+        for client in self.clients:
+            if not client.connected:
+                continue
+            message = StateCodec.pack(StateCodec.encode(self.frames, client.ack, client.baseline, current))
+            client.baseline = current
+            client.writer.write(message)
+            self.bytes_sent += len(message)
+
+    async def run(self, frames=None):
+        """
+        Wait for the players and run the level in real time.
+        :param frames: Number of the steps to run for (until the game is over by default).
+        """
+        await self.joined.wait()
+        step = 1 / self.rate
+        deadline = time.perf_counter()
+        while not self.level.is_over() and (frames is None or self.frames < frames):
+            self.tick()
+            for client in self.clients:
+                if client.connected:
+                    await client.writer.drain()
+            deadline += step
+            await asyncio.sleep(max(0, deadline - time.perf_counter()))
+
+    async def close(self):
+        """
+        Disconnect the clients and stop listening.
+        """
+        for client in self.clients:
+            client.writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class GameClient:
+    """
+    Class that defines a client of the networked multiplayer game.
+    The client mirrors the level of the server: the other character
+    and the health follow the server, while the own character is
+    predicted locally from the inputs as soon as they are sent. Once
+    the server reports the state after an input, the prediction is
+    verified and, if it diverged, corrected by re-applying the inputs
+    the server has not applied yet.
+    """
+
+    def __init__(self, headless=True):
+        """
+        Create a new disconnected client.
+        :param headless: Whether the level is mirrored without a display.
+        :return: Client.
+        """
+        self.headless = headless
+        self.level = None
+        self.index = None
+        self.characters = None
+        self.character = None
+        self.controller = ActionController()
+        # Fields of the characters as reported by the server
+        self.states = [None, None]
+        # Inputs sent but not applied by the server yet
+        self.pending = collections.deque()
+        # Predicted fields after the last input applied by the server
+        self.confirmed = None
+        self.sequence = 0
+        self.frame = 0
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+        # Client statistics
+        self.sent = {}
+        self.latencies = []
+        self.corrections = 0
+        self.bytes_received = 0
+        self.messages = 0
+
+    async def connect(self, host, port):
+        """
+        Connect to the server and mirror its level.
+        :param host: Address of the server.
+        :param port: Port of the server.
+        """
+        (self.reader, self.writer) = await asyncio.open_connection(host, port)
+        message = await StateCodec.read(self.reader)
+        (kind, self.index, seed, width, height) = StateCodec.WELCOME_MESSAGE.unpack_from(message)
+        name = message[StateCodec.WELCOME_MESSAGE.size:].decode("utf-8")
+        self.level = Level(name, True, (width, height), headless=self.headless, seed=seed)
+        self.characters = [self.level.player, self.level.enemy]
+        self.character = self.characters[self.index]
+        self.character.controller = self.controller
+        self.confirmed = StateCodec.capture(self.character)
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    def predict(self, actions):
+        """
+        Advance the own character by a single step the same way the level does.
+        :param actions: Actions of the character.
+        """
+        self.controller.actions = actions
+        self.character.control(None)
+        collision_list = self.level.collision_grid.collide(self.character)
+        if len(collision_list) > 0:
+            self.character.environment_collision(collision_list[0])
+        self.character.update()
+
+    def send_input(self, actions):
+        """
+        Send the actions of the step to the server and predict their outcome.
+        :param actions: Actions of the character.
+        """
+        self.sequence += 1
+        self.level.clock.tick()
+        self.predict(actions)
+        self.pending.append((self.sequence, actions, StateCodec.capture(self.character)))
+        self.sent[self.sequence] = time.perf_counter()
+        self.writer.write(StateCodec.pack(StateCodec.INPUT_MESSAGE.pack(StateCodec.INPUT, self.sequence, actions)))
+
+    async def receive(self):
+        """
+        Receive the state messages until disconnected.
+        """
+        try:
+            while True:
+                message = await StateCodec.read(self.reader)
+                self.bytes_received += StateCodec.LENGTH.size + len(message)
+                self.messages += 1
+                if message[0] == StateCodec.STATE:
+                    self.synchronise(*StateCodec.decode(message, self.states))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def synchronise(self, frame, ack):
+        """
+        Follow the server state and verify the prediction.
+        :param frame: Frame of the server state.
+        :param ack: Sequence number of the last input applied by the server.
+        """
+        self.frame = frame
+        now = time.perf_counter()
+        for (index, fields) in enumerate(self.states):
+            if fields is not None and index != self.index:
+                StateCodec.apply(self.characters[index], fields)
+        # Forget the inputs the server has applied
+        while len(self.pending) > 0 and self.pending[0][0] <= ack:
+            (sequence, actions, self.confirmed) = self.pending.popleft()
+            self.latencies.append(now - self.sent.pop(sequence))
+        # Correct the prediction if it diverged from the server (the health always follows it)
+        server = self.states[self.index]
+        if server is None:
+            return
+        self.character.current = server[4]
+        if server[:StateCodec.MOVEMENT] != self.confirmed[:StateCodec.MOVEMENT]:
+            self.corrections += 1
+            StateCodec.apply(self.character, server, appearance=False)
+            self.confirmed = server
+            pending = self.pending
+            self.pending = collections.deque()
+            for (sequence, actions, fields) in pending:
+                self.predict(actions)
+                self.pending.append((sequence, actions, StateCodec.capture(self.character)))
+
+    async def close(self):
+        """
+        Disconnect from the server.
+        """
+        self.writer.close()
+        if self.receiver is not None:
+            await self.receiver
+
+
+async def run_benchmark(frames, rate):
+    """
+    Play a game of two scripted bots over the loopback and report
+    the bandwidth and the input latency.
+    :param frames: Number of the simulation steps to play.
+    :param rate: Simulation steps per second.
+    :return: Dictionary of the measurements.
+    """
+    server = GameServer(rate=rate, seed=0)
+    await server.start()
+    clients = [GameClient(), GameClient()]
+    for client in clients:
+        await client.connect("127.0.0.1", server.port)
+    running = asyncio.ensure_future(server.run(frames))
+    bots = [ScriptedController(Simulation.BOT_SCRIPT), ScriptedController(((LEFT, 45), (ATTACK, 20), (RIGHT | JUMP, 25)))]
+    # Clients send their inputs at the same rate as the server steps
+    deadline = time.perf_counter()
+    while not running.done():
+        for (client, bot) in zip(clients, bots):
+            client.send_input(bot.get_actions(None))
+        deadline += 1 / rate
+        await asyncio.sleep(max(0, deadline - time.perf_counter()))
+    await running
+    await server.close()
+    for client in clients:
+        await client.close()
+
+    # Full state of both characters for the comparison
+    current = [StateCodec.capture(x) for x in server.characters]
+    full = StateCodec.LENGTH.size + len(StateCodec.encode(0, 0, None, current))
+    latencies = [x * 1000 for client in clients for x in client.latencies]
+    received = sum(x.bytes_received for x in clients)
+    return {
+        "frames": server.frames,
+        "state_bytes_per_frame": server.bytes_sent / max(server.frames * len(clients), 1),
+        "full_state_bytes": full,
+        "input_bytes_per_frame": StateCodec.LENGTH.size + StateCodec.INPUT_MESSAGE.size,
+        "received_bytes": received,
+        "latency_ms_p50": get_percentile(latencies, 50),
+        "latency_ms_p95": get_percentile(latencies, 95),
+        "latency_ms_p99": get_percentile(latencies, 99),
+        "corrections": sum(x.corrections for x in clients),
+    }
+
+
+async def run_client(host, port, rate):
+    """
+    Play the networked game in a window.
+    :param host: Address of the server.
+    :param port: Port of the server.
+    :param rate: Frames per second.
+    """
+    pygame.init()
+    screen = pygame.display.set_mode((1000, 480))
+    pygame.display.set_caption("The Quest of Tin")
+    client = GameClient(headless=False)
+    await client.connect(host, port)
+    level = client.level
+    keyboard = KeyboardController.create()
+    screen.blit(level.background, (0, 0), level.camera.rect)
+    deadline = time.perf_counter()
+    while not level.is_over() and not client.receiver.done():
+        if any(x.type == pygame.QUIT for x in pygame.event.get()):
+            break
+        client.send_input(keyboard.get_actions(InputSnapshot.capture()))
+        # HUD follows the health reported by the server
+        for sprite in level.get_sprites_from_layer(Level.HUD):
+            sprite.update()
+        level.clear(screen, level.background)
+        level.draw(screen)
+        pygame.display.flip()
+        deadline += 1 / rate
+        await asyncio.sleep(max(0, deadline - time.perf_counter()))
+    await client.close()
+
+
+async def run_server(host, port, rate):
+    """
+    Serve a single networked game.
+    :param host: Address to listen on.
+    :param port: Port to listen on.
+    :param rate: Simulation steps per second.
+    """
+    server = GameServer(rate=rate)
+    await server.start(host, port)
+    print("Waiting for the players on port %d" % server.port)
+    await server.run()
+    await server.close()
+
+
+if __name__ == "__main__":
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Networked multiplayer of The Quest of Tin")
+    parser.add_argument("mode", choices=("serve", "connect", "benchmark"), help="what to run")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the server")
+    parser.add_argument("--port", type=int, default=7510, help="port of the server")
+    parser.add_argument("--rate", type=int, default=60, help="simulation steps per second")
+    parser.add_argument("--frames", type=int, default=600, help="number of steps to benchmark")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        asyncio.run(run_server(args.host, args.port, args.rate))
+    elif args.mode == "connect":
+        asyncio.run(run_client(args.host, args.port, args.rate))
+    else:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        for (name, value) in sorted(asyncio.run(run_benchmark(args.frames, args.rate)).items()):
+            print("%-22s %s" % (name, round(value, 3)))
@@ -0,0 +1,119 @@
+import collections
+import csv
+import math
+import time
+
+
+def get_percentile(values, percentile):
+    """
+    Compute the nearest-rank percentile.
+    :param values: Values to be summarised.
+    :param percentile: Percentile between 0 and 100.
+    :return: Percentile of the values (zero if there are none).
+    """
+    values = sorted(values)
+    if len(values) == 0:
+        return 0
+    return values[max(math.ceil(percentile / 100 * len(values)) - 1, 0)]
+
+
+class FrameProfiler:
+    """
+    Class that defines a profiler timing every phase of a frame.
+    The frame is split into phases by laps: each lap is attributed
+    the time since the previous one, so the phases cover the whole
+    frame without nesting. Phases lapped several times in a frame
+    (e.g. when the simulation catches up) are summed. Rolling
+    percentiles are kept over a window of the recent frames and
+    a longer history of the frames can be dumped to CSV.
+    """
+    # Number of the recent frames the percentiles are computed over
+    WINDOW = 600
+    # Number of the frames kept for the CSV dump (10 minutes at 60 frames/sec)
+    HISTORY = 36000
+    # Percentiles that are reported
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, window=WINDOW, history=HISTORY):
+        """
+        Create a new frame profiler.
+        :param window: Number of the recent frames the percentiles are computed over.
+        :param history: Number of the frames kept for the CSV dump.
+        :return: Profiler without any frames.
+        """
+        self.window = window
+        # Phases in the order they were first seen
+        self.phases = []
+        # Recent durations of every phase (in seconds)
+        self.samples = {}
+        # Durations of all the phases in the recent frames
+        self.history = collections.deque(maxlen=history)
+        # Number of the frames profiled so far
+        self.frames = 0
+        # Durations of the phases in the current frame
+        self.current = {}
+        self.frame_start = None
+        self.lap_start = None
+
+    def start_frame(self):
+        """
+        Start timing a new frame.
+        """
+        self.current = {}
+        self.frame_start = self.lap_start = time.perf_counter()
+
+    def lap(self, phase):
+        """
+        Attribute the time since the previous lap to the phase.
+        :param phase: Name of the phase.
+        """
+        if self.lap_start is None:
+            return
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0) + now - self.lap_start
+        self.lap_start = now
+
+    def end_frame(self):
+        """
+        Finish timing the frame and record its phases.
+        """
+        if self.frame_start is None:
+            return
+        self.current["frame"] = time.perf_counter() - self.frame_start
+        for phase in self.current:
+            if phase not in self.samples:
+                self.phases.append(phase)
+                self.samples[phase] = collections.deque(maxlen=self.window)
+        # Phases that did not happen in this frame took no time
+        for phase in self.phases:
+            self.samples[phase].append(self.current.get(phase, 0))
+        self.history.append((self.frames, self.current))
+        self.frames += 1
+        self.frame_start = self.lap_start = None
+
+    def get_percentiles(self, phase):
+        """
+        Compute the rolling percentiles of the phase duration.
+        :param phase: Name of the phase.
+        :return: List of the percentiles in milliseconds.
+        """
+        samples = self.samples.get(phase, ())
+        return [get_percentile(samples, x) * 1000 for x in FrameProfiler.PERCENTILES]
+
+    def get_report(self):
+        """
+        Compute the rolling percentiles of all the phases.
+        :return: List of tuples of the phase name and its percentiles in milliseconds.
+        """
+        return [(phase, self.get_percentiles(phase)) for phase in self.phases]
+
+    def dump(self, path):
+        """
+        Write the durations of the recent frames to a CSV file.
+        :param path: Path to the CSV file.
+        """
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame"] + [x + "_ms" for x in self.phases])
+            for (frame, phases) in self.history:
+                writer.writerow([frame] + ["%.4f" % (phases.get(x, 0) * 1000) for x in self.phases])
@@ -0,0 +1,234 @@
+import argparse
+import struct
+import sys
+import time
+from tqot.simulation import *
+
+
+class RecordingController(Controller):
+    """
+    Class that defines a controller recording the actions picked
+    by another controller on every simulation step.
+    """
+
+    def __init__(self, controller):
+        """
+        Create a new recording controller.
+        :param controller: Controller to be recorded.
+        :return: Recording controller without any actions recorded.
+        """
+        self.controller = controller
+        self.actions = []
+
+    def get_actions(self, snapshot):
+        actions = self.controller.get_actions(snapshot)
+        self.actions.append(actions)
+        return actions
+
+
+class Replay:
+    """
+    Class that defines a recording of a game: the level settings,
+    the seed of its randomness and the actions of the characters
+    on every simulation step. Since the simulation is deterministic,
+    the game can be re-run headless from the recording as fast as
+    possible with identical results. The recording is stored in a
+    compact binary format with the unchanged actions run-length encoded.
+    """
+    # Recording header: signature, version, flags, seed, world size and number of steps
+    MAGIC = b"TQRP"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHBQIII")
+    # Headers of the older versions (the first one limited the world size to 65535 pixels)
+    HEADERS = {1: struct.Struct("<4sHBQHHI"), 2: HEADER}
+    # Outcome of the game: score, tower, player and enemy health
+    OUTCOME = struct.Struct("<Iddd")
+    # Run of the unchanged actions: length and actions of both players
+    RUN = struct.Struct("<HB")
+    # Flags of the level settings
+    MULTIPLAYER = 1
+    SWARM = 2
+    STREAMING = 4
+
+    def __init__(self, name, multiplayer, swarm, seed, size, actions=None, outcome=None, streaming=False):
+        """
+        Create a new recording.
+        :param name: Name of the level.
+        :param multiplayer: Whether this is a multiplayer game.
+        :param swarm: Whether the monsters are simulated as a NumPy swarm.
+        :param seed: Seed of the level randomness.
+        :param size: Size of the world.
+        :param actions: Actions on every step (player in the low bits, enemy in the high bits).
+        :param outcome: Outcome of the recorded game (if finished recording).
+        :param streaming: Whether the level environment is streamed in chunks.
+        :return: Recording.
+        """
+        self.name = name
+        self.multiplayer = multiplayer
+        self.swarm = swarm
+        self.seed = seed
+        self.size = tuple(size)
+        self.actions = actions if actions is not None else []
+        self.outcome = outcome
+        self.streaming = streaming
+        # Controllers recording the characters (if recording)
+        self.recorders = None
+
+    @staticmethod
+    def record(level):
+        """
+        Start recording the level. Must be called before the level is updated.
+        :param level: Level to be recorded.
+        :return: Recording of the level.
+        """
+        replay = Replay(level.definition.name, level.multiplayer, level.swarm is not None, level.seed, level.size,
+                        streaming=level.chunks is not None)
+        replay.recorders = [RecordingController(level.player.controller)]
+        level.player.controller = replay.recorders[0]
+        if level.multiplayer:
+            replay.recorders.append(RecordingController(level.enemy.controller))
+            level.enemy.controller = replay.recorders[1]
+        return replay
+
+    @staticmethod
+    def get_outcome(level):
+        """
+        Identify the outcome of the game.
+        :param level: Level that was played.
+        :return: Tuple of score, tower, player and enemy health.
+        """
+        enemy = level.enemy.current if level.multiplayer else 0
+        return (level.get_time(), level.tower.current, level.player.current, enemy)
+
+    def finish(self, level):
+        """
+        Stop recording and store the outcome of the game.
+        :param level: Level that was recorded.
+        """
+        player = self.recorders[0].actions
+        enemy = self.recorders[1].actions if len(self.recorders) > 1 else [0] * len(player)
+        self.actions = [x | y << 4 for (x, y) in zip(player, enemy)]
+        self.outcome = self.get_outcome(level)
+
+    @staticmethod
+    def encode_runs(actions):
+        """
+        Run-length encode the actions.
+        :param actions: Actions on every step.
+        :return: Encoded runs as bytes.
+        """
+        runs = bytearray()
+        (previous, length) = (None, 0)
+        for action in actions:
+            if action == previous and length < 0xFFFF:
+                length += 1
+                continue
+            if length > 0:
+                runs += Replay.RUN.pack(length, previous)
+            (previous, length) = (action, 1)
+        if length > 0:
+            runs += Replay.RUN.pack(length, previous)
+        return bytes(runs)
+
+    @staticmethod
+    def decode_runs(buffer, offset, steps):
+        """
+        Decode the run-length encoded actions.
+        :param buffer: Buffer with the encoded runs.
+        :param offset: Offset of the first run.
+        :param steps: Number of the encoded steps.
+        :return: Actions on every step.
+        """
+        actions = []
+        while len(actions) < steps:
+            (length, action) = Replay.RUN.unpack_from(buffer, offset)
+            actions.extend([action] * length)
+            offset += Replay.RUN.size
+        if len(actions) != steps:
+            raise ValueError("Recording runs do not match the number of steps")
+        return actions
+
+    def save(self, path):
+        """
+        Store the recording in the file.
+        :param path: Path to the file.
+        """
+        flags = (Replay.MULTIPLAYER if self.multiplayer else 0) | (Replay.SWARM if self.swarm else 0) | \
+                (Replay.STREAMING if self.streaming else 0)
+        name = self.name.encode("utf-8")
+        with open(path, "wb") as file:
+            file.write(Replay.HEADER.pack(Replay.MAGIC, Replay.VERSION, flags, self.seed,
+                                          self.size[0], self.size[1], len(self.actions)))
+            file.write(struct.pack("<H", len(name)) + name)
+            file.write(Replay.OUTCOME.pack(*self.outcome))
+            file.write(self.encode_runs(self.actions))
+
+    @staticmethod
+    def load(path):
+        """
+        Load the recording from the file.
+        :param path: Path to the file.
+        :return: Recording.
+        """
+        with open(path, "rb") as file:
+            buffer = file.read()
+        (magic, version) = struct.unpack_from("<4sH", buffer, 0)
+        if magic != Replay.MAGIC or version not in Replay.HEADERS:
+            raise ValueError("Not a recording of a supported version: " + path)
+        header = Replay.HEADERS[version]
+        (magic, version, flags, seed, width, height, steps) = header.unpack_from(buffer, 0)
+        offset = header.size
+        (length,) = struct.unpack_from("<H", buffer, offset)
+        offset += 2
+        name = buffer[offset:offset + length].decode("utf-8")
+        offset += length
+        outcome = Replay.OUTCOME.unpack_from(buffer, offset)
+        offset += Replay.OUTCOME.size
+        actions = Replay.decode_runs(buffer, offset, steps)
+        return Replay(name, bool(flags & Replay.MULTIPLAYER), bool(flags & Replay.SWARM), seed, (width, height),
+                      actions, outcome, bool(flags & Replay.STREAMING))
+
+    def play(self):
+        """
+        Re-run the recorded game headless as fast as possible.
+        :return: Simulation that has finished replaying.
+        """
+        player = ReplayController([x & 0xF for x in self.actions])
+        simulation = Simulation(self.name, self.multiplayer, self.size, swarm=self.swarm, controller=player,
+                                seed=self.seed, streaming=self.streaming)
+        if self.multiplayer:
+            simulation.level.enemy.controller = ReplayController([x >> 4 for x in self.actions])
+        simulation.step(len(self.actions))
+        return simulation
+
+
+if __name__ == "__main__":
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Replays of The Quest of Tin")
+    parser.add_argument("recording", help="file with the recording")
+    parser.add_argument("--record-bot", type=int, metavar="STEPS",
+                        help="record a game of the scripted bot instead of replaying")
+    parser.add_argument("--level", default="SkyLand", help="name of the level to record")
+    parser.add_argument("--swarm", action="store_true", help="simulate the monsters as a NumPy swarm")
+    args = parser.parse_args()
+
+    if args.record_bot is not None:
+        # Record a load-test fixture with the scripted bot
+        simulation = Simulation(args.level, swarm=args.swarm, controller=ScriptedController(Simulation.BOT_SCRIPT))
+        replay = Replay.record(simulation.level)
+        steps = simulation.step(args.record_bot)
+        replay.finish(simulation.level)
+        replay.save(args.recording)
+        print("Recorded %d steps with the outcome %s" % (steps, replay.outcome))
+        sys.exit(0)
+
+    # Fast-forward through the recording and verify the outcome
+    replay = Replay.load(args.recording)
+    start = time.perf_counter()
+    simulation = replay.play()
+    elapsed = time.perf_counter() - start
+    outcome = Replay.get_outcome(simulation.level)
+    print("Replayed %d steps in %.3f seconds (%.0f steps/sec)" %
+          (simulation.frames, elapsed, simulation.frames / max(elapsed, 1e-9)))
+    print("Recorded outcome %s, replayed outcome %s" % (tuple(replay.outcome), outcome))
+    sys.exit(0 if tuple(replay.outcome) == outcome else 1)
@@ -0,0 +1,85 @@
+import argparse
+import time
+from tqot.environment import *
+
+
+class Simulation:
+    """
+    Class that defines a headless simulation of the game level.
+    The level is stepped without a display: the world size is
+    passed explicitly, the art assets are not converted and,
+    unless requested, not even decoded. The player can be driven
+    by a controller, such as a scripted bot, instead of sitting idle.
+    """
+    # Script of the bot patrolling around the tower and attacking
+    BOT_SCRIPT = ((RIGHT, 60), (ATTACK, 30), (LEFT | JUMP, 20), (LEFT, 100), (ATTACK, 30), (RIGHT, 40))
+
+    def __init__(self, name, multiplayer=False, size=(1000, 480), decode=False, swarm=False, controller=None,
+                 seed=None, streaming=False):
+        """
+        Create a new headless simulation.
+        :param name: Name of the level.
+        :param multiplayer: Whether this is a multiplayer game.
+        :param size: Size of the world.
+        :param decode: Whether the image files should be decoded.
+        :param swarm: Whether the monsters are simulated as a NumPy swarm.
+        :param controller: Controller of the player (the player is idle by default).
+        :param seed: Seed of the level randomness (picked at random by default).
+        :param streaming: Whether the level environment is streamed in chunks.
+        :return: Simulation with the level created.
+        """
+        # Configure the assets to be loaded without a display
+        asset_cache.configure(convert=False, decode=decode)
+        self.name = name
+        self.multiplayer = multiplayer
+        self.size = size
+        self.swarm = swarm
+        self.controller = controller
+        self.seed = seed
+        self.streaming = streaming
+        self.frames = 0
+        self.level = None
+        self.reset()
+
+    def reset(self):
+        """
+        Restart the simulation with a new level.
+        """
+        self.level = Level(self.name, self.multiplayer, self.size, headless=True, swarm=self.swarm, seed=self.seed,
+                           streaming=self.streaming)
+        if self.controller is not None:
+            self.level.player.controller = self.controller
+        self.frames = 0
+
+    def step(self, frames=1):
+        """
+        Advance the simulation.
+        :param frames: Maximum number of frames to simulate.
+        :return: Number of frames simulated before the game was over.
+        """
+        for frame in range(frames):
+            if self.level.is_over():
+                return frame
+            self.level.update()
+            self.frames += 1
+        return frames
+
+
+if __name__ == "__main__":
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Headless simulation of The Quest of Tin")
+    parser.add_argument("--level", default="SkyLand", help="name of the level")
+    parser.add_argument("--multiplayer", action="store_true", help="simulate a multiplayer game")
+    parser.add_argument("--frames", type=int, default=10000, help="number of frames to simulate")
+    parser.add_argument("--decode", action="store_true", help="decode the image files")
+    parser.add_argument("--swarm", action="store_true", help="simulate the monsters as a NumPy swarm")
+    parser.add_argument("--bot", action="store_true", help="drive the player with a scripted bot")
+    args = parser.parse_args()
+
+    # Simulate the level as fast as possible
+    controller = ScriptedController(Simulation.BOT_SCRIPT) if args.bot else None
+    simulation = Simulation(args.level, args.multiplayer, decode=args.decode, swarm=args.swarm, controller=controller)
+    start = time.perf_counter()
+    frames = simulation.step(args.frames)
+    elapsed = time.perf_counter() - start
+    print("Simulated %d frames in %.3f seconds (%.0f frames/sec)" % (frames, elapsed, frames / max(elapsed, 1e-9)))
@@ -1,8 +1,10 @@
+import collections
 import pygame.display
 import pygame.image
-import pygame.key
 import pygame.sprite
 from tqot.animation import *
+from tqot.assets import *
+from tqot.controls import *
 from tqot.logic import *
 
 
@@ -16,6 +18,8 @@ class GravitySprite(pygame.sprite.Sprite):
     """
     gravity = 3
     ground = 32
+    # Size of the world (None if it matches the display)
+    world_size = None
 
     def __init__(self):
         """
@@ -31,9 +35,7 @@ class GravitySprite(pygame.sprite.Sprite):
         the screen.
         """
         # Identify the size of the screen
-        surface = pygame.display.get_surface()
-        width = surface.get_width()
-        height = surface.get_height()
+        (width, height) = get_world_size(self.world_size)
         # Fix the sprite position
         if self.rect.right < 0:
             self.rect.x = width - self.rect.width
@@ -78,18 +80,12 @@ class AssetSprite(GravitySprite):
         self.rect = pygame.Rect(0, 0, 0, 0)
         self.reload_asset()
 
-    def get_asset(self):
-        """
-        Identify the relative path to the assets of the sprite.
-        :return: Path as a string.
-        """
-        return "../assets/" + self._name + "-" + self._state + ".png"
-
     def reload_asset(self):
         """
         Reload the associated art asset and update its bounding rectangle.
+        The surface is shared with other sprites through the asset cache.
         """
-        self.image = pygame.image.load(self.get_asset()).convert_alpha()
+        self.image = asset_cache.load(self._name, self._state)
         # Preserve the position of the sprite when updating the bounding box
         (x, y) = (self.rect.x, self.rect.y)
         self.rect = self.image.get_rect()
@@ -113,6 +109,26 @@ class AssetSprite(GravitySprite):
         if invalidated:
             self.reload_asset()
 
+    def get_frame(self, state):
+        """
+        Retrieve the appearance of the sprite in the given state.
+        :param state: State of the sprite.
+        :return: Shared surface of the art asset.
+        """
+        return asset_cache.load(self._name, state)
+
+    def set_frame(self, state, image):
+        """
+        Update the state of the sprite along with its already resolved appearance.
+        :param state: New state.
+        :param image: Surface of the art asset in the new state.
+        """
+        self._state = state
+        self.image = image
+        # Preserve the position of the sprite when the bounding box changes
+        if image.get_size() != self.rect.size:
+            self.rect.size = image.get_size()
+
 
 class LookerSprite(AssetSprite):
     """
@@ -162,16 +178,31 @@ class MonsterAimer(AssetSprite, Damageable):
     ATTACK_VALUE = 10
     ALT_ATTACK_VALUE = 2
 
-    def __init__(self, aim):
-        # Identify the monster type
-        type = random.choice([True, False])
-
+    def __init__(self, aim, rng=None):
         # Initialise the asset sprite
-        super().__init__(MonsterAimer.ASSET_NAME if type else MonsterAimer.ALT_ASSET_NAME, "StandingRight")
+        super().__init__(MonsterAimer.ASSET_NAME, "StandingRight")
         # Remove gravity for the sprite
         self.gravity = 0
         # Store the aim of the monster
         self.aim = aim
+        # Random number generator to pick the monster type with
+        self.random = rng if rng is not None else random
+        # Initialise the logic
+        self.revive()
+
+    def revive(self):
+        """
+        Turn the monster into a freshly spawned one of a random type.
+        Allows the dead monsters to be recycled.
+        """
+        # Identify the monster type
+        type = self.random.choice([True, False])
+
+        # Reset the appearance of the monster
+        self.kind = 0 if type else 1
+        self._name = MonsterAimer.ASSET_NAME if type else MonsterAimer.ALT_ASSET_NAME
+        self._state = "StandingRight"
+        self.reload_asset()
         # Initialise the logic
         health = MonsterAimer.MAXIMUM_HEALTH if type else MonsterAimer.ALT_MAXIMUM_HEALTH
         self.speed = MonsterAimer.SPEED if type else MonsterAimer.ALT_SPEED
@@ -206,6 +237,84 @@ class MonsterAimer(AssetSprite, Damageable):
             self.character_dead(self)
 
 
+class MonsterPool:
+    """
+    Class that defines a pool of the monsters. Active monsters
+    are kept in an insertion-ordered dictionary, so that they can
+    be removed in constant time, while the dead ones are recycled
+    instead of allocating new sprites. Monsters that died while
+    the level was updated are only recycled once they are collected,
+    since they might still be finishing their own update.
+    """
+
+    def __init__(self, aim, rng=None):
+        """
+        Create a new empty pool.
+        :param aim: Aim of the monsters created by the pool.
+        :param rng: Random number generator of the monsters (the global one by default).
+        :return: Monster pool.
+        """
+        self.aim = aim
+        self.random = rng
+        # Monsters that are currently in play
+        self.active = collections.OrderedDict()
+        # Monsters that died since the last collection
+        self.dead = []
+        # Monsters that are ready to be recycled
+        self.free = []
+        # Pool statistics
+        self.hits = 0
+        self.allocations = 0
+
+    def __len__(self):
+        return len(self.active)
+
+    def __iter__(self):
+        return iter(self.active)
+
+    def acquire(self):
+        """
+        Retrieve a freshly spawned monster, recycling a dead one if possible.
+        :return: Monster sprite.
+        """
+        if len(self.free) > 0:
+            monster = self.free.pop()
+            monster.revive()
+            self.hits += 1
+        else:
+            monster = MonsterAimer(self.aim, self.random)
+            self.allocations += 1
+        self.active[monster] = None
+        return monster
+
+    def remove(self, monster):
+        """
+        Take the monster out of play and keep it for recycling.
+        :param monster: Dead monster.
+        """
+        del self.active[monster]
+        self.dead.append(monster)
+
+    def collect(self):
+        """
+        Make the dead monsters available for recycling.
+        """
+        self.free.extend(self.dead)
+        self.dead = []
+
+    def get_stats(self):
+        """
+        Retrieve the pool statistics.
+        :return: Dictionary with hits, allocations, active and free monster counts.
+        """
+        return {
+            "hits": self.hits,
+            "allocations": self.allocations,
+            "active": len(self.active),
+            "free": len(self.free) + len(self.dead),
+        }
+
+
 class Tin(AssetSprite, Damageable):
     """
     Class that defines and facilitates the management of
@@ -220,35 +329,36 @@ class Tin(AssetSprite, Damageable):
     jump = 0
     # Maximum jump actions in sequence
     jump_limit = 20
+    # Actions taken in the current simulation step
+    actions = 0
 
-    def __init__(self, alt_style = False):
+    def __init__(self, alt_style = False, clock=None):
         # Initialise the asset sprite
         super().__init__(Tin.ASSET_NAME if not alt_style else Tin.ALT_ASSET_NAME, "StandingRight")
         # Setup the animations
-        self.runRight = Animation(self)
+        self.runRight = Animation(self, clock)
         self.runRight.add_frame("StandingRight", 50)
         self.runRight.add_frame("MovingRight", 50)
         self.runRight.add_frame("MovingRight2", 50)
-        self.runLeft = Animation(self)
+        self.runLeft = Animation(self, clock)
         self.runLeft.add_frame("StandingLeft", 50)
         self.runLeft.add_frame("MovingLeft", 50)
         self.runLeft.add_frame("MovingLeft2", 50)
-        self.attackRight = Animation(self)
+        self.attackRight = Animation(self, clock)
         self.attackRight.add_frame("StandingRight", 50)
         self.attackRight.add_frame("AttackRight", 50)
         self.attackRight.add_frame("StandingRight", 50)
-        self.attackLeft = Animation(self)
+        self.attackLeft = Animation(self, clock)
         self.attackLeft.add_frame("StandingLeft", 50)
         self.attackLeft.add_frame("AttackLeft", 50)
         self.attackLeft.add_frame("StandingLeft", 50)
+        # Animation that is currently playing (if any)
+        self.animation = None
         # Initialise the logic
         self.set_health(Tin.MAXIMUM_HEALTH, Tin.MAXIMUM_HEALTH)
         self.attacking = False
         # Setup the control scheme
-        self.button_attack = pygame.K_RALT if not alt_style else pygame.K_LCTRL
-        self.button_left = pygame.K_LEFT if not alt_style else pygame.K_a
-        self.button_right = pygame.K_RIGHT if not alt_style else pygame.K_d
-        self.button_top = pygame.K_UP if not alt_style else pygame.K_w
+        self.controller = KeyboardController.create(alt_style)
 
     def environment_collision(self, sprite):
         """
@@ -276,46 +386,52 @@ class Tin(AssetSprite, Damageable):
         # Reset the jump counter when we hit a surface
         self.jump = 0
 
+    def animate(self, animation):
+        """
+        Play the animation, stopping the one that was playing before.
+        :param animation: Animation to be played (None to stop animating).
+        """
+        if animation is not self.animation:
+            if self.animation is not None:
+                self.animation.stop()
+            self.animation = animation
+        if animation is not None:
+            animation.play()
+
+    def control(self, snapshot):
+        """
+        Let the controller pick the actions for the simulation step.
+        :param snapshot: Input snapshot of the frame.
+        """
+        self.actions = self.controller.get_actions(snapshot)
+
     def update(self):
         # Reset the state
         self.attacking = False
-
-        # Identify all the keys being currently pressed
-        pressed_keys = pygame.key.get_pressed()
+        actions = self.actions
 
         # Rotate the sprite based on character's direction
-        if pressed_keys[self.button_attack]:
-            self.runLeft.stop()
-            self.runRight.stop()
+        if actions & ATTACK:
+            # Stop running before identifying the direction
+            if self.animation is self.runLeft or self.animation is self.runRight:
+                self.animate(None)
             # Play either left or right attack animation
-            if self.get_state().endswith("Right"):
-                self.attackRight.play()
-            else:
-                self.attackLeft.play()
+            self.animate(self.attackRight if self.get_state().endswith("Right") else self.attackLeft)
             # Identify that the character is attacking
             self.attacking = True
-        elif pressed_keys[self.button_left]:
+        elif actions & LEFT:
             # Move left on left key press
-            self.runRight.stop()
-            self.attackLeft.stop()
-            self.attackRight.stop()
-            self.runLeft.play()
+            self.animate(self.runLeft)
             self.rect.x -= 5
-        elif pressed_keys[self.button_right]:
+        elif actions & RIGHT:
             # Move right on right key press
-            self.runLeft.stop()
-            self.attackLeft.stop()
-            self.attackRight.stop()
-            self.runRight.play()
+            self.animate(self.runRight)
             self.rect.x += 5
         else:
             # Stop moving when nothing is pressed
-            self.runLeft.stop()
-            self.runRight.stop()
-            self.attackRight.stop()
-            self.attackLeft.stop()
+            self.animate(None)
 
-        if pressed_keys[self.button_top]:
+        if actions & JUMP:
             # Process jump action on space
             if self.jump < self.jump_limit:
                 self.rect.y -= 10
@@ -0,0 +1,234 @@
+import numpy
+import random
+from tqot.sprites import *
+
+
+class MonsterSwarm:
+    """
+    Class that defines a swarm of the monsters taking the same
+    passive tactic as MonsterAimer. Instead of a sprite per monster,
+    positions, speeds, health, attack values and facing are stored
+    in NumPy arrays (ordered by spawn time) and updated in batches.
+    The monsters are drawn with a single batched blit call.
+    """
+    # Monster kinds in the same order as MonsterAimer picks them
+    KINDS = (MonsterAimer.ASSET_NAME, MonsterAimer.ALT_ASSET_NAME)
+    # Monster states
+    STANDING_RIGHT = 0
+    STANDING_LEFT = 1
+    DEAD = 2
+    STATES = ("StandingRight", "StandingLeft", "Dead")
+
+    def __init__(self, aim, size, capacity=64, rng=None):
+        """
+        Create a new empty swarm.
+        :param aim: Sprite that the monsters are going for.
+        :param size: Size of the world.
+        :param capacity: Initial capacity of the arrays.
+        :param rng: Random number generator of the monsters (the global one by default).
+        :return: Monster swarm.
+        """
+        self.aim = aim
+        self.world_size = size
+        self.random = rng if rng is not None else random
+        # Callback invoked after a monster has been removed
+        self.character_dead = None
+        # Appearance of every kind in every state
+        self.images = [[asset_cache.load(kind, state) for state in MonsterSwarm.STATES]
+                       for kind in MonsterSwarm.KINDS]
+        self.widths = numpy.array([[x.get_width() for x in images] for images in self.images])
+        self.heights = numpy.array([[x.get_height() for x in images] for images in self.images])
+        # Parameters of every kind
+        self.kind_health = numpy.array([MonsterAimer.MAXIMUM_HEALTH, MonsterAimer.ALT_MAXIMUM_HEALTH], dtype=float)
+        self.kind_speed = numpy.array([MonsterAimer.SPEED, MonsterAimer.ALT_SPEED])
+        self.kind_attack = numpy.array([MonsterAimer.ATTACK_VALUE, MonsterAimer.ALT_ATTACK_VALUE], dtype=float)
+        # Monster properties (only the first count entries are in use)
+        self.count = 0
+        self.x = numpy.zeros(capacity, dtype=int)
+        self.y = numpy.zeros(capacity, dtype=int)
+        self.kind = numpy.zeros(capacity, dtype=int)
+        self.state = numpy.zeros(capacity, dtype=int)
+        self.health = numpy.zeros(capacity, dtype=float)
+        self.speed = numpy.zeros(capacity, dtype=int)
+        self.attack = numpy.zeros(capacity, dtype=float)
+        # Rectangles covered by the swarm when it was last drawn
+        self.drawn = []
+
+    def __len__(self):
+        return self.count
+
+    def get_arrays(self):
+        """
+        Retrieve all the property arrays.
+        :return: List of the arrays.
+        """
+        return [self.x, self.y, self.kind, self.state, self.health, self.speed, self.attack]
+
+    def spawn(self, spawn_manager):
+        """
+        Spawn a new monster, making the same random choices as MonsterAimer.
+        :param spawn_manager: Spawner manager to position the monster with.
+        """
+        # Grow the arrays if needed
+        if self.count == len(self.x):
+            (self.x, self.y, self.kind, self.state, self.health, self.speed, self.attack) = \
+                [numpy.concatenate((x, numpy.zeros_like(x))) for x in self.get_arrays()]
+
+        # Identify the monster type
+        kind = 0 if self.random.choice([True, False]) else 1
+        # Position the monster
+        spot = pygame.sprite.Sprite()
+        spot.rect = self.images[kind][MonsterSwarm.STANDING_RIGHT].get_rect()
+        spawn_manager.set_location(spot)
+
+        # Initialise the logic
+        index = self.count
+        self.x[index] = spot.rect.x
+        self.y[index] = spot.rect.y
+        self.kind[index] = kind
+        self.state[index] = MonsterSwarm.STANDING_RIGHT
+        self.health[index] = self.kind_health[kind]
+        self.speed[index] = self.kind_speed[kind]
+        self.attack[index] = self.kind_attack[kind]
+        self.count += 1
+
+    def remove(self, index):
+        """
+        Remove the monster while preserving the order of the others.
+        :param index: Index of the monster.
+        """
+        for array in self.get_arrays():
+            array[index:self.count - 1] = array[index + 1:self.count]
+        self.count -= 1
+
+    def collide(self, rect):
+        """
+        Identify the monsters colliding with the rectangle.
+        :param rect: Rectangle to be checked.
+        :return: Boolean mask of the colliding monsters.
+        """
+        n = self.count
+        kind = self.kind[:n]
+        state = self.state[:n]
+        x = self.x[:n]
+        y = self.y[:n]
+        return ((x < rect.right) & (rect.left < x + self.widths[kind, state]) &
+                (y < rect.bottom) & (rect.top < y + self.heights[kind, state]))
+
+    def character_collision(self, sprite):
+        """
+        Let the character attack all the monsters it collides with.
+        :param sprite: Attacking character.
+        """
+        if sprite.attacking and sprite.rect.width > 0 and sprite.rect.height > 0:
+            self.health[:self.count][self.collide(sprite.rect)] -= Tin.ATTACK_VALUE
+
+    def update(self):
+        n = self.count
+        x = self.x[:n]
+        y = self.y[:n]
+        kind = self.kind[:n]
+        state = self.state[:n]
+        health = self.health[:n]
+        aim = self.aim.rect
+        alive = health > 0
+
+        # Follow the aim
+        width = self.widths[kind, state]
+        moving = (aim.centerx > x + width // 2) & (aim.left > x + width) & alive
+        x[moving] += self.speed[:n][moving]
+        state[moving] = MonsterSwarm.STANDING_RIGHT
+        width = self.widths[kind, state]
+        moving = (aim.centerx < x + width // 2) & (aim.right < x) & alive
+        x[moving] -= self.speed[:n][moving]
+        state[moving] = MonsterSwarm.STANDING_LEFT
+        width = self.widths[kind, state]
+
+        # Reached the target - strike and die
+        striking = ((x + width == aim.left) | (x == aim.right)) & alive
+        for attack in self.attack[:n][striking].tolist():
+            self.aim.current -= attack
+        health[striking] = -1
+
+        # If dead turn into a cloud of dust and float away
+        dead = health <= 0
+        state[dead] = MonsterSwarm.DEAD
+        y[dead] -= 1
+
+        # Keep the monsters on the screen
+        (world_width, world_height) = get_world_size(self.world_size)
+        width = self.widths[kind, state]
+        height = self.heights[kind, state]
+        x[:] = numpy.where(x + width < 0, world_width - width, x)
+        floating = y < 0
+        y[floating] = 0
+        grounded = y + height > world_height - GravitySprite.ground
+        y[:] = numpy.where(grounded, world_height - GravitySprite.ground - height, y)
+        x[x > world_width] = 0
+
+        # Out of screen means that we floated away as a cloud
+        removed = numpy.flatnonzero(floating | grounded)
+        for (offset, index) in enumerate(removed):
+            self.remove(index - offset)
+            if self.character_dead is not None:
+                self.character_dead()
+
+    def clear(self, surface, background, offset=(0, 0)):
+        """
+        Erase the monsters where they were last drawn.
+        :param surface: Surface to erase the monsters from.
+        :param background: Background to restore the areas with.
+        :param offset: Position of the surface in the background.
+        """
+        for rect in self.drawn:
+            surface.blit(background, rect, rect.move(offset))
+
+    def draw(self, surface, offset=(0, 0), area=None):
+        """
+        Draw all the monsters in a single batch.
+        :param surface: Surface to draw the monsters on.
+        :param offset: Position of the surface in the world.
+        :param area: Area of the world to draw the monsters in (all the monsters by default).
+        :return: List of the changed rectangles.
+        """
+        images = self.images
+        n = self.count
+        (kind, state, x, y) = (self.kind[:n], self.state[:n], self.x[:n], self.y[:n])
+        if area is not None:
+            visible = self.get_visible(area)
+            (kind, state, x, y) = (kind[visible], state[visible], x[visible], y[visible])
+        (dx, dy) = offset
+        sequence = [(images[k][s], (i - dx, j - dy)) for (k, s, i, j) in
+                    zip(kind.tolist(), state.tolist(), x.tolist(), y.tolist())]
+        dirty = self.drawn
+        self.drawn = surface.blits(sequence)
+        return dirty + self.drawn
+
+    def get_visible(self, area):
+        """
+        Identify the monsters overlapping the area.
+        :param area: Rectangle in the world.
+        :return: Boolean mask of the monsters.
+        """
+        n = self.count
+        (kind, state, x, y) = (self.kind[:n], self.state[:n], self.x[:n], self.y[:n])
+        return ((x < area.right) & (x + self.widths[kind, state] > area.left) &
+                (y < area.bottom) & (y + self.heights[kind, state] > area.top))
+
+    def get_rects(self, offset=(0, 0), area=None):
+        """
+        Identify the areas the monsters occupy.
+        :param offset: Position of the surface in the world.
+        :param area: Area of the world to identify the monsters in (all the monsters by default).
+        :return: List of rectangles.
+        """
+        n = self.count
+        (kind, state, x, y) = (self.kind[:n], self.state[:n], self.x[:n], self.y[:n])
+        if area is not None:
+            visible = self.get_visible(area)
+            (kind, state, x, y) = (kind[visible], state[visible], x[visible], y[visible])
+        (dx, dy) = offset
+        widths = self.widths[kind, state].tolist()
+        heights = self.heights[kind, state].tolist()
+        return [pygame.Rect(i - dx, j - dy, w, h) for (i, j, w, h) in
+                zip(x.tolist(), y.tolist(), widths, heights)]
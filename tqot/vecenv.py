@@ -0,0 +1,320 @@
+import argparse
+import multiprocessing
+import numpy
+import os
+import random
+import time
+from tqot.simulation import *
+
+
+class GameEnv:
+    """
+    Class that defines a gym-style environment around a headless
+    single-player level. The agent picks the actions of the player
+    on every simulation step and observes the tower health, the
+    player state and the monster positions as a flat NumPy array:
+
+    tower health, player x, y, health, attacking, jump counter,
+    time in seconds, monster count, then x, y, health and kind of
+    every monster (padded with zeros up to the maximum).
+    """
+    # Number of the values describing the level and the player
+    HEADER = 8
+    # Number of the values describing a monster
+    MONSTER = 4
+    # Default maximum number of the observed monsters
+    MAX_MONSTERS = 32
+
+    def __init__(self, name="SkyLand", size=(1000, 480), swarm=False, max_monsters=MAX_MONSTERS,
+                 max_steps=None, seed=None):
+        """
+        Create a new environment. The level is created on reset.
+        :param name: Name of the level.
+        :param size: Size of the world.
+        :param swarm: Whether the monsters are simulated as a NumPy swarm.
+        :param max_monsters: Maximum number of the observed monsters.
+        :param max_steps: Number of steps after which the game is cut short (if any).
+        :param seed: Seed of the generator picking the level seeds.
+        :return: Environment without a level.
+        """
+        self.name = name
+        self.size = size
+        self.swarm = swarm
+        self.max_monsters = max_monsters
+        self.max_steps = max_steps
+        self.random = random.Random(seed)
+        self.controller = ActionController()
+        self.simulation = None
+        self.observation_size = GameEnv.HEADER + GameEnv.MONSTER * max_monsters
+
+    def reset(self, seed=None):
+        """
+        Start a new game.
+        :param seed: Seed of the level randomness (drawn from the environment seed by default).
+        :return: Observation of the new game.
+        """
+        if seed is None:
+            seed = self.random.getrandbits(64)
+        self.controller.actions = 0
+        if self.simulation is None:
+            self.simulation = Simulation(self.name, size=self.size, swarm=self.swarm, controller=self.controller,
+                                         seed=seed)
+        else:
+            self.simulation.seed = seed
+            self.simulation.reset()
+        return self.observe()
+
+    def step(self, actions):
+        """
+        Advance the game by a single simulation step.
+        :param actions: Actions of the player as bit flags.
+        :return: Tuple of the observation, reward, whether the game is over and the score.
+        """
+        self.controller.actions = int(actions)
+        self.simulation.step()
+        level = self.simulation.level
+        done = level.is_over() or (self.max_steps is not None and self.simulation.frames >= self.max_steps)
+        # Every survived step is rewarded
+        return (self.observe(), 1.0, done, level.get_time())
+
+    def observe(self, out=None):
+        """
+        Describe the current state of the game.
+        :param out: Array to write the observation to (a new one by default).
+        :return: Observation array.
+        """
+        if out is None:
+            out = numpy.zeros(self.observation_size, dtype=numpy.float32)
+        level = self.simulation.level
+        player = level.player
+        out[:GameEnv.HEADER] = (level.tower.current, player.rect.x, player.rect.y, player.current,
+                                player.attacking, player.jump, level.get_time(), len(level.monsters))
+        monsters = out[GameEnv.HEADER:].reshape(self.max_monsters, GameEnv.MONSTER)
+        if level.swarm is not None:
+            swarm = level.swarm
+            n = min(swarm.count, self.max_monsters)
+            monsters[:n, 0] = swarm.x[:n]
+            monsters[:n, 1] = swarm.y[:n]
+            monsters[:n, 2] = swarm.health[:n]
+            monsters[:n, 3] = swarm.kind[:n]
+        else:
+            n = 0
+            for monster in level.monsters:
+                if n == self.max_monsters:
+                    break
+                monsters[n] = (monster.rect.x, monster.rect.y, monster.current, monster.kind)
+                n += 1
+        monsters[n:] = 0
+        return out
+
+
+def apply_constants(constants):
+    """
+    Override the difficulty constants of the game classes.
+    :param constants: Dictionary of the names such as MonsterAimer.SPEED to their values.
+    """
+    import tqot.environment
+    for (name, value) in constants.items():
+        (owner, attribute) = name.split(".")
+        setattr(getattr(tqot.environment, owner), attribute, value)
+
+
+def step_envs(envs, indices, buffers):
+    """
+    Step the environments with the actions from the shared memory
+    and write the results back. Finished games are reset.
+    :param envs: Environments to be stepped.
+    :param indices: Indices of the environments in the shared memory.
+    :param buffers: Shared observations, actions, rewards, dones and scores.
+    """
+    (observations, actions, rewards, dones, scores) = buffers
+    for (env, index) in zip(envs, indices):
+        (observation, reward, done, score) = env.step(actions[index])
+        rewards[index] = reward
+        dones[index] = done
+        scores[index] = score
+        if done:
+            observation = env.reset()
+        observations[index] = observation
+
+
+def run_worker(connection, indices, shared, options, constants):
+    """
+    Step a slice of the environments on the commands from the runner.
+    :param connection: Pipe to the runner.
+    :param indices: Indices of the environments handled by the worker.
+    :param shared: Raw shared arrays of the observations, actions, rewards, dones and scores.
+    :param options: Arguments of the environments.
+    :param constants: Difficulty constants to be overridden.
+    """
+    apply_constants(constants)
+    envs = [GameEnv(**dict(options, seed=options["seed"] + x)) for x in indices]
+    buffers = VectorEnv.wrap(shared, envs[0].observation_size if len(envs) > 0 else 0)
+    while True:
+        command = connection.recv()
+        if command == "reset":
+            for (env, index) in zip(envs, indices):
+                buffers[0][index] = env.reset()
+        elif command == "step":
+            step_envs(envs, indices, buffers)
+        connection.send(command)
+        if command == "close":
+            break
+    connection.close()
+
+
+class VectorEnv:
+    """
+    Class that defines a runner stepping many independent games
+    in lockstep across a pool of processes. Actions and results are
+    exchanged through the shared memory rather than pickled, the
+    pipes only carry the commands. Finished games are reset
+    automatically, reporting their final score once.
+    """
+
+    def __init__(self, count, workers=None, constants=None, seed=0, **options):
+        """
+        Create the environments and start the worker processes.
+        :param count: Number of the environments.
+        :param workers: Number of the worker processes (one per core by default, zero to run in-process).
+        :param constants: Difficulty constants to be overridden in the workers.
+        :param seed: Seed of the first environment (others use the following ones).
+        :param options: Other arguments of the environments.
+        :return: Vectorised environment.
+        """
+        self.count = count
+        self.workers = workers if workers is not None else min(os.cpu_count() or 1, count)
+        self.constants = constants if constants is not None else {}
+        options["seed"] = seed
+        self.observation_size = GameEnv(**options).observation_size
+        self.shared = [multiprocessing.RawArray("f", count * self.observation_size),
+                       multiprocessing.RawArray("B", count),
+                       multiprocessing.RawArray("f", count),
+                       multiprocessing.RawArray("B", count),
+                       multiprocessing.RawArray("i", count)]
+        self.buffers = VectorEnv.wrap(self.shared, self.observation_size)
+        self.connections = []
+        self.processes = []
+        self.envs = []
+        if self.workers == 0:
+            apply_constants(self.constants)
+            self.envs = [GameEnv(**dict(options, seed=seed + x)) for x in range(count)]
+            return
+        # Split the environments evenly between the workers
+        for worker in range(self.workers):
+            indices = list(range(worker, count, self.workers))
+            (parent, child) = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_worker,
+                                              args=(child, indices, self.shared, options, self.constants),
+                                              daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    @staticmethod
+    def wrap(shared, observation_size):
+        """
+        View the raw shared arrays as NumPy arrays.
+        :param shared: Raw shared arrays.
+        :param observation_size: Size of a single observation.
+        :return: List of observations, actions, rewards, dones and scores arrays.
+        """
+        (observations, actions, rewards, dones, scores) = shared
+        return [numpy.frombuffer(observations, dtype=numpy.float32).reshape(-1, observation_size),
+                numpy.frombuffer(actions, dtype=numpy.uint8),
+                numpy.frombuffer(rewards, dtype=numpy.float32),
+                numpy.frombuffer(dones, dtype=numpy.bool_),
+                numpy.frombuffer(scores, dtype=numpy.int32)]
+
+    def command(self, command):
+        """
+        Send the command to all the workers and wait for them to finish.
+        :param command: Command name.
+        """
+        for connection in self.connections:
+            connection.send(command)
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self):
+        """
+        Start new games in all the environments.
+        :return: Observations as a two-dimensional array.
+        """
+        if self.workers == 0:
+            for (index, env) in enumerate(self.envs):
+                self.buffers[0][index] = env.reset()
+        else:
+            self.command("reset")
+        return self.buffers[0]
+
+    def step(self, actions):
+        """
+        Advance all the games by a single simulation step.
+        :param actions: Actions of the players as bit flags.
+        :return: Tuple of the observations, rewards, dones and scores arrays (shared, do not keep).
+        """
+        self.buffers[1][:] = actions
+        if self.workers == 0:
+            step_envs(self.envs, range(self.count), self.buffers)
+        else:
+            self.command("step")
+        return tuple(self.buffers[0:1] + self.buffers[2:])
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if len(self.connections) > 0:
+            self.command("close")
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Batch headless play of The Quest of Tin")
+    parser.add_argument("--envs", type=int, default=64, help="number of games played at once")
+    parser.add_argument("--workers", type=int, help="number of worker processes (one per core by default)")
+    parser.add_argument("--games", type=int, default=256, help="number of games to finish")
+    parser.add_argument("--policy", choices=("idle", "random"), default="random", help="actions of the players")
+    parser.add_argument("--swarm", action="store_true", help="simulate the monsters as a NumPy swarm")
+    parser.add_argument("--set", action="append", default=[], metavar="CLASS.NAME=VALUE",
+                        help="override a difficulty constant, e.g. MonsterAimer.SPEED=2")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    args = parser.parse_args()
+    constants = {}
+    for assignment in args.set:
+        (name, value) = assignment.split("=")
+        constants[name] = float(value) if "." in value else int(value)
+
+    # Play until enough games are finished
+    generator = numpy.random.default_rng(args.seed)
+    results = []
+    start = time.perf_counter()
+    with VectorEnv(args.envs, args.workers, constants, args.seed, swarm=args.swarm) as env:
+        env.reset()
+        steps = 0
+        while len(results) < args.games:
+            if args.policy == "random":
+                actions = generator.integers(0, 16, args.envs)
+            else:
+                actions = numpy.zeros(args.envs, dtype=numpy.uint8)
+            (observations, rewards, dones, scores) = env.step(actions)
+            results.extend(scores[dones].tolist())
+            steps += args.envs
+    elapsed = time.perf_counter() - start
+    results = numpy.array(results[:args.games])
+    print("Finished %d games (%d steps) in %.1f seconds: %.0f games/min, %.0f steps/sec" %
+          (len(results), steps, elapsed, len(results) / elapsed * 60, steps / elapsed))
+    print("Score mean %.1f, p50 %.0f, min %d, max %d" %
+          (results.mean(), numpy.median(results), results.min(), results.max()))